@@ -21,10 +21,21 @@ Controls
 * Space bar to shoot
 * f key to toggle between fullscreen.
 
+Benchmarking
+------------
+
+Run with --headless to play a fixed number of frames under the SDL dummy
+drivers, with a scripted player and no frame cap:
+
+    python mahadi_alien.py --headless --frames 5000 --seed 1 [--json]
+
 """
 
+import collections
+import json
 import random
 import os
+import time
 
 # import basic pygame modules
 import pygame as pg
@@ -40,6 +51,7 @@ ALIEN_ODDS = 22  # chances a new alien appears
 BOMB_ODDS = 60  # chances a new bomb will drop
 ALIEN_RELOAD = 12  # frames between new aliens
 SCREENRECT = pg.Rect(0, 0, 640, 480)
+PIXEL_PERFECT = True  # check collision masks after the rects overlap
 SCORE = 0
 
 main_dir = os.path.split(os.path.abspath(__file__))[0]
@@ -68,6 +80,26 @@ def load_sound(file):
     return None
 
 
+masks = {}
+
+
+def get_mask(surface):
+    """returns the collision mask of an image, made once per image"""
+    try:
+        return masks[surface]
+    except KeyError:
+        mask = masks[surface] = pg.mask.from_surface(surface)
+        return mask
+
+
+def collide_mask(left, right):
+    """pg.sprite.collide_mask with cached masks, tested only if the rects hit"""
+    if not left.rect.colliderect(right.rect):
+        return False
+    offset = right.rect.x - left.rect.x, right.rect.y - left.rect.y
+    return get_mask(left.image).overlap(get_mask(right.image), offset) is not None
+
+
 # Each type of game object gets an init and an update function.
 # The update function is called once per frame, and it is when each object should
 # change its current position and state.
@@ -192,15 +224,13 @@ class Shot(pg.sprite.Sprite):
     """a bullet the Player sprite fires."""
 
     speed = -11
-    images = []
+    size = (8, 8)
+    images = []  # already scaled to 'size' when loaded
 
     def __init__(self, pos):
         pg.sprite.Sprite.__init__(self, self.containers)
         self.image = self.images[0]
-        # self.rect = self.image.get_rect(midbottom=pos)
-        self.image = self.images[0]
-        self.image = pg.transform.scale(self.image, (8,8))
-        self.rect = pg.Rect(pos[0], pos[1], 50, 50)
+        self.rect = self.image.get_rect(midbottom=pos)
 
     def update(self):
         """called every time around the game loop.
@@ -258,7 +288,70 @@ class Score(pg.sprite.Sprite):
             self.image = self.font.render(msg, 0, self.color)
 
 
-def main(winstyle=0):
+class ScriptedInput:
+    """Stands in for pg.key.get_pressed() when running headless.
+
+    Wanders left and right and keeps pulling the trigger, so a benchmark
+    run exercises shots, collisions and explosions like a real player.
+    """
+
+    def __init__(self, seed=None):
+        self.rng = random.Random(seed)
+        self.direction = 1
+
+    def get_pressed(self):
+        if not self.rng.randrange(30):
+            self.direction = self.rng.choice((-1, 0, 1))
+        keystate = collections.defaultdict(int)
+        keystate[pg.K_LEFT] = self.direction < 0
+        keystate[pg.K_RIGHT] = self.direction > 0
+        keystate[pg.K_SPACE] = self.rng.randrange(2)
+        return keystate
+
+
+class PhaseTimer:
+    """Adds up the wall time spent in each phase of the main loop."""
+
+    def __init__(self):
+        self.totals = collections.OrderedDict()
+        self.last = time.perf_counter()
+
+    def start(self):
+        self.last = time.perf_counter()
+
+    def lap(self, phase):
+        """charge the time since the last lap to 'phase'"""
+        now = time.perf_counter()
+        self.totals[phase] = self.totals.get(phase, 0.0) + now - self.last
+        self.last = now
+
+
+def print_stats(stats):
+    """prints the numbers main() returns when running headless"""
+    print("%(frames)d frames in %(seconds).2fs: %(fps).1f fps" % stats)
+    for phase, seconds in stats["phases"].items():
+        print(
+            "  %-8s %8.3f ms/frame"
+            % (phase, 1000.0 * seconds / max(stats["frames"], 1))
+        )
+    print("  peak sprites: %s" % ", ".join(
+        "%s=%d" % item for item in stats["peaks"].items()))
+    print("  score %(score)d, deaths %(deaths)d" % stats)
+
+
+def main(winstyle=0, headless=False, frames=0, seed=None):
+    """Runs the game.
+
+    With headless=True, 'frames' frames are run uncapped with scripted
+    input under the SDL dummy drivers. The player respawns when killed,
+    and a dict of timing statistics is returned.
+    """
+    if headless:
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
+        os.environ["SDL_AUDIODRIVER"] = "dummy"
+    if seed is not None:
+        random.seed(seed)
+
     # Initialize pygame
     if pg.get_sdl_version()[0] == 2:
         pg.mixer.pre_init(44100, 32, 2, 1024)
@@ -282,7 +375,13 @@ def main(winstyle=0):
     Alien.images = [load_image(im) for im in ("alien1.png", "alien2.png", "alien3.png")]
     Plane.images = [load_image(i) for i in ("plane3.gif", "plane3.gif", "plane3.gif")]
     Bomb.images = [load_image("bomb.gif")]
-    Shot.images = [load_image("shot.gif")]
+    Shot.images = [pg.transform.scale(load_image("shot.gif"), Shot.size)]
+    if PIXEL_PERFECT:
+        # make the collision masks now, for every frame including the flips
+        for cls in (Player, Explosion, Alien, Plane, Bomb, Shot):
+            for image in cls.images:
+                get_mask(image)
+    collided = collide_mask if PIXEL_PERFECT else None
 
     # decorate the game window
     icon = pg.transform.scale(Alien.images[0], (32, 32))
@@ -331,14 +430,35 @@ def main(winstyle=0):
 
     # initialize our starting sprites
     global SCORE
+    SCORE = 0
     player = Player()
     Plane()
     Alien()  # note, this 'lives' because it goes into a sprite group
     if pg.font:
         all.add(Score())
 
+    if headless:
+        scripted = ScriptedInput(seed)
+    groups = collections.OrderedDict(
+        [("all", all), ("aliens", aliens), ("planes", planes),
+         ("shots", shots), ("bombs", bombs)]
+    )
+    peaks = collections.OrderedDict((name, 0) for name in groups)
+    timer = PhaseTimer()
+    frame = deaths = 0
+    started = time.perf_counter()
+
     # Run our main loop whilst the player is alive.
-    while player.alive():
+    # Headless runs respawn the player and stop after 'frames' frames.
+    while player.alive() or headless:
+        if headless:
+            if frame >= frames:
+                break
+            if not player.alive():
+                deaths = deaths + 1
+                player = Player()
+        frame = frame + 1
+        timer.start()
 
         # get input
         for event in pg.event.get():
@@ -365,7 +485,11 @@ def main(winstyle=0):
                     pg.display.flip()
                     fullscreen = not fullscreen
 
-        keystate = pg.key.get_pressed()
+        if headless:
+            keystate = scripted.get_pressed()
+        else:
+            keystate = pg.key.get_pressed()
+        timer.lap("event")
 
         # clear/erase the last drawn sprites
         all.clear(screen, background)
@@ -382,6 +506,7 @@ def main(winstyle=0):
             if pg.mixer:
                 shoot_sound.play()
         player.reloading = firing
+        timer.lap("update")
 
         # Create new alien
         if alienreload:
@@ -398,8 +523,10 @@ def main(winstyle=0):
         if last_palne and not int(random.random()* BOMB_ODDS):
             Bomb(last_palne.sprite)
 
+        timer.lap("spawn")
+
         # Detect collisions between aliens and players.
-        for plane in pg.sprite.spritecollide(player,planes,1):
+        for plane in pg.sprite.spritecollide(player, planes, 1, collided):
             if pg.mixer:
                 boom_sound.play()
             Explosion(plane)
@@ -407,7 +534,7 @@ def main(winstyle=0):
             SCORE = SCORE + 1
             player.kill()
 
-        for alien in pg.sprite.spritecollide(player, aliens, 1):
+        for alien in pg.sprite.spritecollide(player, aliens, 1, collided):
             if pg.mixer:
                 boom_sound.play()
             Explosion(alien)
@@ -416,32 +543,52 @@ def main(winstyle=0):
             player.kill()
 
         # See if shots hit the aliens.
-        for plane in pg.sprite.groupcollide(planes, shots, 1,1).keys():
+        for plane in pg.sprite.groupcollide(planes, shots, 1, 1, collided).keys():
             if pg.mixer:
                 boom_sound.play()
             Explosion(plane)
             SCORE = SCORE + 1
 
-        for alien in pg.sprite.groupcollide(aliens, shots, 1, 1).keys():
+        for alien in pg.sprite.groupcollide(aliens, shots, 1, 1, collided).keys():
             if pg.mixer:
                 boom_sound.play()
             Explosion(alien) 
             SCORE = SCORE + 1
 
         # See if alien boms hit the player.
-        for bomb in pg.sprite.spritecollide(player, bombs, 1):
+        for bomb in pg.sprite.spritecollide(player, bombs, 1, collided):
             if pg.mixer:
                 boom_sound.play()
             Explosion(player)
             Explosion(bomb)
             player.kill()
 
+        timer.lap("collide")
+
+        for name, group in groups.items():
+            peaks[name] = max(peaks[name], len(group))
+
         # draw the scene
         dirty = all.draw(screen)
         pg.display.update(dirty)
+        timer.lap("draw")
 
         # cap the framerate at 40fps. Also called 40HZ or 40 times per second.
-        clock.tick(40)
+        # Headless runs are uncapped, to see how fast the loop can go.
+        clock.tick(0 if headless else 40)
+
+    if headless:
+        seconds = time.perf_counter() - started
+        return {
+            "frames": frame,
+            "seconds": seconds,
+            "fps": frame / seconds if seconds else 0.0,
+            "phases": timer.totals,
+            "peaks": peaks,
+            "score": SCORE,
+            "deaths": deaths,
+            "seed": seed,
+        }
 
     if pg.mixer:
         pg.mixer.music.fadeout(1000)
@@ -450,5 +597,25 @@ def main(winstyle=0):
 
 # call the "main" function if running this script
 if __name__ == "__main__":
-    main()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Pygame Tysenator")
+    parser.add_argument("--headless", action="store_true",
+                        help="run uncapped under the dummy drivers and print timings")
+    parser.add_argument("--frames", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", action="store_true",
+                        help="print the headless statistics as JSON")
+    parser.add_argument("--rect-collide", action="store_true",
+                        help="skip the pixel perfect mask test")
+    args = parser.parse_args()
+    PIXEL_PERFECT = not args.rect_collide
+    if args.headless:
+        stats = main(headless=True, frames=args.frames, seed=args.seed)
+        if args.json:
+            print(json.dumps(stats))
+        else:
+            print_stats(stats)
+    else:
+        main()
     pg.quit()
@@ -14,15 +14,88 @@ Controls
 * Left and right arrows to move.
 * Space bar to shoot
 * f key to toggle between fullscreen.
+Benchmarking
+------------
+Run with --headless to play a fixed number of frames under the SDL dummy
+drivers, with a scripted player and no frame cap. It prints frames per
+second, time spent in each phase of the main loop and peak sprite counts:
+
+    python aliens.py --headless --frames 5000 --seed 1 [--json]
+
+Games can be recorded and replayed headless, faster than real time,
+checking that they end with the same score and sprites:
+
+    python aliens.py --record game.log
+    python aliens.py --replay game.log
+
+Balancing changes can be tried on thousands of headless games at once,
+spread over every core, with the averages per combination written to CSV:
+
+    python aliens.py --sweep alien_odds=11,22,44 --sweep bomb_odds=30,60 \\
+        --games 50 --bot --out sweep.csv
+
+Other options:
+* --max-shots, --alien-odds, --bomb-odds and --alien-reload override
+  the game constants, and --enemy-speed and --bomb-speed scale the
+  sprites' own speeds, in percent.
+* --pool-size sets how many killed sprites are kept for reuse.
+* --scroll-speed sets how fast the background scrolls; at 0 the
+  screen is only updated where sprites moved.
+* --rect-collide turns off the pixel perfect collision masks.
+* --bench-collide compares the cost of the collision grid with brute
+  force pg.sprite collision at growing sprite counts.
+* --tick-rate sets how many times a second the game is simulated, and
+  --frame-rate how many times it may be drawn, e.g. 144 for a fast
+  display; sprites are drawn in between their positions of the last
+  two ticks.
+* --build-atlas packs the sprite and button images into data/atlas.png
+  with an index in data/atlas.json, so the game opens and decodes one
+  file instead of a dozen; run it again after changing those images.
+* --build-bundle decodes the images and sounds the game loads into
+  data/assets.bundle, which is memory mapped instead of decoding files
+  at every start; build it after the atlas. It is ignored once any of
+  the files it was made from change, and --no-bundle ignores it too.
+* --profile shows the p50/p95/p99 milliseconds of each phase of the
+  main loop over the last 600 frames; F3 toggles it while playing.
+* --trace FILE writes every phase of every frame to FILE as Chrome trace
+  events while playing, for chrome://tracing or ui.perfetto.dev.
+* --numpy-movers moves the enemies and bombs with numpy arrays, and
+  --bench-movers compares that with per sprite updates.
+* --sessions N steps N headless games side by side in one process,
+  seeded from --seed on, as a game server would.
+* The game runs in real time on an asyncio event loop, and with
+  --telemetry HOST:PORT sends its hits, deaths and score there as JSON
+  lines. --async plays a headless game the same way, sending them to a
+  stand-in server on the loopback interface without --telemetry, and
+  prints how late the ticks were. --check-async checks that all of them
+  arrived and the ticks kept time.
 """
 
+import asyncio
+import collections
+import concurrent.futures
+import csv
+import itertools
+import json
+import mmap
 import random
 import os
+import struct
+import threading
+import time
+import tracemalloc
+import zlib
 from re import S
 
 # import basic pygame modules
 import pygame as pg
 
+# numpy is optional, it is only needed by MoverEngine
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 # see if we can load more than standard BMP
 if not pg.image.get_extended():
     raise SystemExit("Sorry, extended image module required")
@@ -33,32 +106,519 @@ MAX_SHOTS = 2  # most player bullets onscreen
 ALIEN_ODDS = 22  # chances a new alien appears
 BOMB_ODDS = 60  # chances a new bomb will drop
 ALIEN_RELOAD = 12  # frames between new aliens
+ENEMY_SPEED = 100  # percent of every enemy kind's own speed
+BOMB_SPEED = 100  # percent of the bombs' own speed
 SCREENRECT = pg.Rect(0, 0, 640, 480)
-SCORE = 0
+PIXEL_PERFECT = True  # check collision masks after the rects overlap
+POOL_SIZE = 256  # most killed shots/bombs/explosions kept for reuse, per class
+NUMPY_MOVERS = False  # move enemies and bombs with the numpy MoverEngine
+SCROLL_SPEED = 3  # pixels the background scrolls down each tick
+TICK_RATE = 40  # game ticks per second, all the speeds are per tick
+FRAME_RATE = 40  # most frames drawn per second, 0 for no limit
+MAX_FRAMESKIP = 5  # most ticks run for one drawn frame before the game slows
+MENU_FRAME_RATE = 30  # most times a second the menu is redrawn
+MENU_TIMEOUT = 1000  # most milliseconds the menu sleeps waiting for input
+MIXER_FORMAT = (44100, 32, 2, 1024)  # frequency, float samples, stereo, buffer
+MIXER_CHANNELS = 8  # voices the sound effects share
+# The sound effects: file, priority and most voices playing it at once.
+# An effect with no voice free takes one from a lower or equal priority.
+EFFECTS = collections.OrderedDict([
+    ("boom", ("boom.wav", 3, 4)),
+    ("punch", ("punch.wav", 2, 2)),
+    ("shoot", ("car_door.wav", 1, 2)),
+])
+
+# The layers of the 'all' group, drawn bottom to top
+LAYER_SHIPS, LAYER_PROJECTILES, LAYER_EFFECTS, LAYER_HUD = range(4)
 
 main_dir = os.path.split(os.path.abspath(__file__))[0]
 
-def load_image(file):
-    """loads an image, prepares it for play"""
+
+class AssetCache:
+    """Keeps loaded images and sounds around, so each one is decoded once.
+
+    Entries are keyed by (path, conversion mode, size) and shared between
+    everybody asking for them, so callers must not draw onto a cached
+    surface. Once the cached pixel and sample data grows past 'max_bytes'
+    the least recently used entries are dropped.
+
+    The AssetLoader's threads share it too. Whoever asks for an entry that
+    another thread is loading waits for that load instead of starting one.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.loading = {}
+        self.entries = collections.OrderedDict()
+        self.sizes = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, load):
+        """returns the asset cached under 'key', calling load() on a miss"""
+        with self.lock:
+            if key in self.entries:
+                self.hits = self.hits + 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            loading = self.loading.get(key)
+            if loading is None:
+                self.misses = self.misses + 1
+                self.loading[key] = threading.Event()
+        if loading is not None:
+            loading.wait()
+            return self.get(key, load)
+        try:
+            asset = load()
+            with self.lock:
+                self.entries[key] = asset
+                self.sizes[key] = self.asset_bytes(asset)
+                self.bytes = self.bytes + self.sizes[key]
+                self.trim()
+        finally:
+            with self.lock:
+                self.loading.pop(key).set()
+        return asset
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def trim(self):
+        """evicts least recently used entries until we fit in max_bytes"""
+        while self.bytes > self.max_bytes and len(self.entries) > 1:
+            key, _ = self.entries.popitem(last=False)
+            self.bytes = self.bytes - self.sizes.pop(key)
+            self.evictions = self.evictions + 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.sizes.clear()
+            self.bytes = 0
+
+    @staticmethod
+    def asset_bytes(asset):
+        if asset is None:
+            return 0
+        if isinstance(asset, pg.Surface) and asset.get_parent():
+            return 0  # the pixels belong to the atlas
+        if isinstance(asset, pg.Surface):
+            return asset.get_pitch() * asset.get_height()
+        frequency, size, channels = pg.mixer.get_init()
+        return int(asset.get_length() * frequency * channels * abs(size) // 8)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+        }
+
+
+assets = AssetCache()
+
+
+class AssetBundle:
+    """Images and sounds decoded ahead of time, all in one file.
+
+    Pixels are kept in the display's pixel format and sounds as the
+    mixer's samples. The file is memory mapped read only and images are
+    surfaces straight over the mapped pages, so nothing is decoded or
+    copied, and every game running on the machine shares the same pages.
+    pygame copies sound samples once when making a Sound, without any
+    decoding.
+
+    The size and modification time of every file it was made from, and
+    of atlas.json, are kept in the header. If any of them changed since,
+    the bundle is out of date and refuses to open.
+    """
+
+    magic = b"ALIENBDL"
+    align = 64
+    formats = {
+        (0xFF0000, 0xFF00, 0xFF, 0xFF000000): "BGRA",
+        (0xFF, 0xFF00, 0xFF0000, 0xFF000000): "RGBA",
+    }
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        if bytes(self.view[:8]) != self.magic:
+            raise ValueError('"%s" is not an asset bundle' % path)
+        (length,) = struct.unpack_from("<I", self.map, 8)
+        header = json.loads(bytes(self.view[12:12 + length]).decode())
+        sources = header.get("sources")
+        if sources is None or any(
+            self.stamp(file) != stamp for file, stamp in sources.items()
+        ):
+            raise ValueError('"%s" is out of date, run --build-bundle' % path)
+        self.base = self.aligned(12 + length)
+        self.mixer = header["mixer"] and tuple(header["mixer"])
+        self.entries = header["entries"]
+
+    @staticmethod
+    def stamp(file):
+        """the size and modification time of a data file, None without it"""
+        try:
+            info = os.stat(os.path.join(main_dir, "data", file))
+        except OSError:
+            return None
+        return [info.st_size, info.st_mtime_ns]
+
+    @classmethod
+    def aligned(cls, offset):
+        return -(-offset // cls.align) * cls.align
+
+    def data(self, entry):
+        offset = self.base + entry[0]
+        return self.view[offset:offset + entry[1]]
+
+    def image(self, key):
+        """the surface stored under 'key', or None"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        return pg.image.frombuffer(self.data(entry), entry[2], entry[3])
+
+    def sound(self, key):
+        """the Sound stored under 'key', or None if it isn't there or was
+        stored for another mixer format"""
+        entry = self.entries.get(key)
+        if entry is None or pg.mixer.get_init() != self.mixer:
+            return None
+        return pg.mixer.Sound(buffer=self.data(entry))
+
+    @classmethod
+    def write(cls, path, images, sounds, sources):
+        """writes 'images' and 'sounds', dicts of surfaces and Sounds by key,
+        made from the data files 'sources'"""
+        entries = {}
+        blobs = []
+        offset = 0
+        for key, surface in images.items():
+            format = cls.formats.get(surface.get_masks(), "RGBA")
+            blob = pg.image.tobytes(surface, format)
+            entries[key] = [offset, len(blob), list(surface.get_size()), format]
+            blobs.append((offset, blob))
+            offset = cls.aligned(offset + len(blob))
+        for key, sound in sounds.items():
+            blob = sound.get_raw()
+            entries[key] = [offset, len(blob)]
+            blobs.append((offset, blob))
+            offset = cls.aligned(offset + len(blob))
+        header = json.dumps({
+            "mixer": pg.mixer.get_init(),
+            "entries": entries,
+            "sources": dict((file, cls.stamp(file)) for file in sources),
+        }).encode()
+        base = cls.aligned(12 + len(header))
+        with open(path, "wb") as f:
+            f.write(cls.magic + struct.pack("<I", len(header)) + header)
+            for offset, blob in blobs:
+                f.seek(base + offset)
+                f.write(blob)
+
+
+BUNDLE = True
+bundle = None
+
+
+def get_bundle():
+    """the AssetBundle in data/assets.bundle, or None without one"""
+    global bundle
+    if bundle is None:
+        bundle = False
+        if BUNDLE:
+            try:
+                bundle = AssetBundle(os.path.join(main_dir, "data", "assets.bundle"))
+            except OSError:
+                pass
+            except ValueError as e:
+                print("Warning, %s" % e)
+    return bundle or None
+
+
+def bundle_key(file, convert, size=None):
+    return "%s:%s" % (convert, atlas_key(file, size))
+
+
+class AssetLoader:
+    """Loads images and sounds into the asset cache on a few threads.
+
+    image() and sound() queue a load and return at once, and loads run
+    in the order they were queued. Getting the asset is left to
+    load_image() and load_sound() as usual, which return it straight
+    from the cache when it's done and wait for it while it's loading.
+    """
+
+    def __init__(self, workers=min(4, os.cpu_count() or 1)):
+        self.workers = workers
+        self.pool = None
+
+    def submit(self, key, load, *args):
+        if key in assets:
+            return
+        if self.pool is None:
+            # open the bundle and atlas index before the threads race for them
+            get_bundle()
+            atlas_rect("")
+            self.pool = concurrent.futures.ThreadPoolExecutor(
+                self.workers, thread_name_prefix="assets"
+            )
+        # failures are raised again when the main thread asks for it
+        self.pool.submit(load, *args)
+
+    def image(self, file, size=None):
+        """start loading an image, as load_image(file, size=size) would"""
+        path = os.path.join(main_dir, "data", file)
+        self.submit((path, "alpha", size and tuple(size)), load_image, file, "alpha", size)
+
+    def sound(self, file):
+        """start loading a sound, as load_sound(file) would"""
+        if pg.mixer:
+            path = os.path.join(main_dir, "data", file)
+            self.submit((path, "sound", None), load_sound, file)
+
+
+loader = AssetLoader()
+
+
+def load_image(file, convert="alpha", size=None):
+    """loads an image, prepares it for play
+
+    'convert' is "alpha" for convert_alpha(), "opaque" for convert() or
+    None to keep the file's own format, and 'size' scales the image.
+    Images come from the shared asset cache, so don't draw on them.
+    Images packed into the atlas come back as subsurfaces of it.
+    """
+    name = file
     file = os.path.join(main_dir, "data", file)
-    try:
-        surface = pg.image.load(file)
-    except pg.error:
-        raise SystemExit('Could not load image "%s" %s' % (file, pg.get_error()))
-    return surface.convert_alpha()
+
+    def load():
+        if get_bundle():
+            surface = bundle.image(bundle_key(name, convert, size))
+            if surface:
+                return surface
+        rect = atlas_rect(name, size) if convert == "alpha" else None
+        if rect:
+            return load_image("atlas.png").subsurface(rect)
+        if size is not None:
+            return pg.transform.scale(load_image(file, convert), size)
+        try:
+            surface = pg.image.load(file)
+        except pg.error:
+            raise SystemExit('Could not load image "%s" %s' % (file, pg.get_error()))
+        if convert == "alpha":
+            return surface.convert_alpha()
+        if convert == "opaque":
+            return surface.convert()
+        return surface
+
+    return assets.get((file, convert, size and tuple(size)), load)
 
 
 def load_sound(file):
     """because pygame can be be compiled without mixer."""
     if not pg.mixer:
         return None
+    name = file
     file = os.path.join(main_dir, "data", file)
+
+    def load():
+        if get_bundle():
+            sound = bundle.sound(bundle_key(name, "sound"))
+            if sound:
+                return sound
+        try:
+            return pg.mixer.Sound(file)
+        except pg.error:
+            print("Warning, unable to load, %s" % file)
+        return None
+
+    return assets.get((file, "sound", None), load)
+
+
+# One frame a sprite class shows: an image file at 'size', flipped
+# (xbool, ybool), rotated 'rotate' degrees and multiplied by a 'tint' color.
+Frame = collections.namedtuple("Frame", "file size flip rotate tint")
+Frame.__new__.__defaults__ = (None, None, 0, None)
+
+
+def load_frame(frame):
+    """Returns the image for a Frame, transformed the first time only.
+
+    The transformed frames live in the asset cache with the images, under
+    its memory budget, so sprites never transform anything while playing.
+    """
+    image = load_image(frame.file, size=frame.size)
+    if frame == Frame(frame.file, frame.size):
+        return image
+
+    def load():
+        surface = image
+        if frame.flip:
+            surface = pg.transform.flip(surface, *frame.flip)
+        if frame.rotate:
+            surface = pg.transform.rotate(surface, frame.rotate)
+        if frame.tint:
+            if surface is image:
+                surface = image.copy()
+            surface.fill(frame.tint, special_flags=pg.BLEND_RGB_MULT)
+        return surface
+
+    return assets.get(("frame",) + tuple(frame), load)
+
+
+def atlas_images():
+    """the images --build-atlas packs, at the sizes the game loads them
+
+    The big backgrounds stay in their own files.
+    """
+    return [
+        ("player1.gif", None),
+        ("explosion1.gif", None),
+        ("alien1.gif", None),
+        ("alien2.gif", None),
+        ("alien3.gif", None),
+        ("bomb.gif", None),
+        ("shot.gif", None),
+        ("plane.png", Balloon.size),
+        ("plane4.png", Plane.size),
+        ("plane4.png", (100, 100)),
+        ("alienny2.png", None),
+        ("alienny2.png", OtherAlien.size),
+        ("button_resume.png", None),
+        ("button_options.png", None),
+        ("button_quit.png", None),
+        ("button_back.png", None),
+    ]
+
+
+ATLAS_WIDTH = 512
+atlas_index = None
+
+
+def atlas_key(file, size):
+    if size is None:
+        return file
+    return "%s@%dx%d" % (file, size[0], size[1])
+
+
+def atlas_rect(file, size=None):
+    """where 'file' at 'size' is in the atlas, or None if it isn't packed"""
+    global atlas_index
+    if atlas_index is None:
+        try:
+            with open(os.path.join(main_dir, "data", "atlas.json")) as f:
+                atlas_index = json.load(f)["images"]
+        except (OSError, ValueError, KeyError):
+            atlas_index = {}
+    return atlas_index.get(atlas_key(file, size))
+
+
+def build_atlas(width=ATLAS_WIDTH, padding=1):
+    """Packs atlas_images() into data/atlas.png and data/atlas.json.
+
+    Run it again after changing any of the images, load_image() reads the
+    packed copy of an image when there is one. Images are placed tallest
+    first along shelves 'width' pixels wide.
+    """
+    images = []
+    for file, size in atlas_images():
+        if atlas_key(file, size) in (atlas_key(*image[:2]) for image in images):
+            continue
+        try:
+            loaded = pg.image.load(os.path.join(main_dir, "data", file))
+        except pg.error:
+            raise SystemExit('Could not load image "%s" %s' % (file, pg.get_error()))
+        surface = pg.Surface(loaded.get_size(), pg.SRCALPHA)
+        surface.blit(loaded, (0, 0))
+        if size is not None:
+            surface = pg.transform.scale(surface, size)
+        images.append((file, size, surface))
+
+    index = {}
+    x = y = shelf = 0
+    for file, size, surface in sorted(images, key=lambda image: -image[2].get_height()):
+        w, h = surface.get_size()
+        if x + w > width:
+            x, y, shelf = 0, y + shelf + padding, 0
+        index[atlas_key(file, size)] = [x, y, w, h]
+        x = x + w + padding
+        shelf = max(shelf, h)
+
+    atlas = pg.Surface((width, y + shelf), pg.SRCALPHA)
+    for file, size, surface in images:
+        atlas.blit(surface, index[atlas_key(file, size)][:2])
+    pg.image.save(atlas, os.path.join(main_dir, "data", "atlas.png"))
+    with open(os.path.join(main_dir, "data", "atlas.json"), "w") as f:
+        json.dump({"images": index}, f, indent=1, sort_keys=True)
+    print("packed %d images into %dx%d" % (len(images), width, y + shelf))
+
+
+def build_bundle():
+    """Decodes the game's images and sounds into data/assets.bundle.
+
+    Run it after --build-atlas, and again after changing any of them.
+    """
+    global BUNDLE
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    os.environ["SDL_AUDIODRIVER"] = "dummy"
+    # the same display and mixer formats main() asks for
+    if pg.get_sdl_version()[0] == 2:
+        pg.mixer.pre_init(*MIXER_FORMAT)
+    pg.init()
+    pg.display.set_mode(SCREENRECT.size)
+    BUNDLE = False
+    files = [("background4.png", ScrollingBackground.size), ("background3.gif", (640, 480))]
+    if any(atlas_rect(*image) for image in atlas_images()):
+        files.append(("atlas.png", None))
+    else:
+        files.extend(atlas_images())
+    images = dict(
+        (bundle_key(file, "alpha", size), load_image(file, size=size))
+        for file, size in files
+    )
+    sounds = {}
+    if pg.mixer and pg.mixer.get_init():
+        for file in SOUNDS:
+            sounds[bundle_key(file, "sound")] = load_sound(file)
+    path = os.path.join(main_dir, "data", "assets.bundle")
+    # atlas_rect() reads atlas.json, so a new index needs a new bundle too
+    sources = [file for file, size in files] + list(SOUNDS) + ["atlas.json"]
+    AssetBundle.write(path, images, sounds, sources)
+    print("bundled %d images and %d sounds, %d bytes"
+          % (len(images), len(sounds), os.path.getsize(path)))
+
+
+masks = {}
+
+
+def get_mask(surface):
+    """returns the collision mask of an image, made once per image
+
+    Sprite frames are shared surfaces, so every sprite showing a frame
+    shares its mask too.
+    """
     try:
-        sound = pg.mixer.Sound(file)
-        return sound
-    except pg.error:
-        print("Warning, unable to load, %s" % file)
-    return None
+        return masks[surface]
+    except KeyError:
+        mask = masks[surface] = pg.mask.from_surface(surface)
+        return mask
+
+
+def collide_mask(left, right):
+    """pg.sprite.collide_mask with cached masks, tested only if the rects hit"""
+    if not left.rect.colliderect(right.rect):
+        return False
+    offset = right.rect.x - left.rect.x, right.rect.y - left.rect.y
+    return get_mask(left.image).overlap(get_mask(right.image), offset) is not None
 
 
 # Each type of game object gets an init and an update function.
@@ -75,10 +635,13 @@ class Player(pg.sprite.Sprite):
     speed = 10
     bounce = 24
     gun_offset = -11
-    images = []
+    _layer = LAYER_SHIPS
+    containers = ("all",)  # the names of the Game groups it goes in
+    frames = [Frame("player1.gif"), Frame("player1.gif", flip=(1, 0))]
+    images = []  # the loaded 'frames'
 
-    def __init__(self):
-        pg.sprite.Sprite.__init__(self, self.containers)
+    def __init__(self, game):
+        pg.sprite.Sprite.__init__(self, game.groups(self))
         self.image = self.images[0]
         self.rect = self.image.get_rect(midbottom=SCREENRECT.midbottom)
         self.reloading = 0
@@ -101,75 +664,44 @@ class Player(pg.sprite.Sprite):
         return pos, self.rect.top
 
 
-class Balloon(pg.sprite.Sprite):
-    """A simple balloon"""
-                                                                                                                                                                                                                      
-    speed = 4
-    animcycle = 100
-    images = []
-
-    def __init__(self):
-        pg.sprite.Sprite.__init__(self, self.containers)
-        self.image = self.images[0]
-        self.image = pg.transform.scale(self.image, (100, 100))
-        self.rect = pg.Rect(10, 10, 100, 100)
-        self.facing = random.choice((-1, 1)) * Balloon.speed
-        self.frame = 0
-        if self.facing < 0:
-            self.rect.right = SCREENRECT.right
-             
-    def update(self):
-        self.rect.move_ip(self.facing, 0)
-        if not SCREENRECT.contains(self.rect):
-            self.facing = -self.facing
-            self.rect.top = self.rect.bottom + 1
-            self.rect = self.rect.clamp(SCREENRECT)
-        self.frame = self.frame + 1
-        # self.image = self.images[self.frame // self.animcycle % 3]
-
-  
-
-class Alien(pg.sprite.Sprite):
-    """An alien space ship. That slowly moves down the screen."""
-
-    speed = 4
-    animcycle = 12
-    images = []
-
-    def __init__(self):
-        pg.sprite.Sprite.__init__(self, self.containers)
-        self.image = self.images[0]
-        self.rect = self.image.get_rect()
-        self.facing = random.choice((-1, 1)) * Alien.speed
-        self.frame = 0
-        if self.facing < 0:
-            self.rect.right = SCREENRECT.right
-
-    def update(self):
-        self.rect.move_ip(self.facing, 0)
-        if not SCREENRECT.contains(self.rect):
-            self.facing = -self.facing
-            self.rect.top = self.rect.bottom + 1
-            self.rect = self.rect.clamp(SCREENRECT)
-        self.frame = self.frame + 1
-        self.image = self.images[self.frame // self.animcycle % 3]
-
+class Enemy(pg.sprite.Sprite):
+    """Something to shoot down, of one of the kinds in ENEMY_TYPES.
 
-class Plane(pg.sprite.Sprite):
+    Enemies move across the screen and drop a row every time they reach
+    an edge. They all share this code and the one 'enemies' group, and
+    each kind is a subclass made from its ENEMY_TYPES entry, so a new
+    kind is a new entry and costs nothing extra per frame.
+    """
 
     speed = 4
-    images = []
-
-    def __init__(self):
-        pg.sprite.Sprite.__init__(self, self.containers)
+    animcycle = 0  # ticks per frame of animation, 0 for none
+    size = None  # the first image's size if None
+    topleft = (0, 0)
+    sides = (-1, 1)  # the directions it can start in, picked at random
+    bomb_odds = None  # the game's bomb_odds setting if None, 0 for no bombs
+    sound = "boom"  # the SoundBoard effect played when it is hit
+    score = 1
+    _layer = LAYER_SHIPS
+    containers = ("enemies", "all", "updated")
+    frames = []
+    images = []  # the loaded 'frames'
+
+    def __init__(self, game):
+        pg.sprite.Sprite.__init__(self, game.groups(self))
+        self.game = game
         self.image = self.images[0]
-        self.image = pg.transform.scale(self.image,(90,70))
-        self.rect = pg.Rect(10, 10, 90,70)
-        #self.rect = self.image.get_rect()
-        self.facing = random.choice((-1, 1)) * Plane.speed
+        self.rect = pg.Rect(self.topleft, self.size or self.image.get_size())
+        speed = game.speeds[type(self)]
+        if len(self.sides) > 1:
+            self.facing = game.rng.choice(self.sides) * speed
+        else:
+            self.facing = self.sides[0] * speed
         self.frame = 0
         if self.facing < 0:
             self.rect.right = SCREENRECT.right
+        if game.engine:
+            game.engine.add(self, vx=self.facing, bounce=True, cycle=self.animcycle,
+                            frames=len(self.images))
 
     def update(self):
         self.rect.move_ip(self.facing, 0)
@@ -178,29 +710,124 @@ class Plane(pg.sprite.Sprite):
             self.rect.top = self.rect.bottom + 1
             self.rect = self.rect.clamp(SCREENRECT)
         self.frame = self.frame + 1
-
-class OtherAlien(Alien):
-    images = []
-    speed = 4
-    def __init__(self):
-        pg.sprite.Sprite.__init__(self, self.containers)
-        self.image = self.images[0]
-        self.image = pg.transform.scale(self.image, (80, 71))
-        self.rect = pg.Rect(10, 10, 80, 71)
-        self.facing = OtherAlien.speed
-        self.frame = 0
-
-class Explosion(pg.sprite.Sprite):
+        if self.animcycle:
+            self.image = self.images[self.frame // self.animcycle % len(self.images)]
+
+    def drops_bomb(self):
+        """whether it drops a bomb this tick"""
+        odds = self.game.settings.bomb_odds if self.bomb_odds is None else self.bomb_odds
+        return odds and not int(self.game.rng.random() * odds)
+
+
+# The kinds of enemies, by the name the options menu and --enemy use.
+# Each one becomes a subclass of Enemy named 'name', with the rest of
+# its entry as class attributes.
+ENEMY_TYPES = [
+    dict(key="plane", name="Plane", size=(90, 70), topleft=(10, 10),
+         frames=[Frame("plane4.png", (90, 70))] * 2),
+    dict(key="balloon", name="Balloon", size=(100, 100), topleft=(10, 10),
+         frames=[Frame("plane.png", (100, 100))], bomb_odds=0, sound="punch"),
+    # An alien space ship. That slowly moves down the screen.
+    dict(key="alien", name="Alien", animcycle=12,
+         frames=[Frame("alien1.gif"), Frame("alien2.gif"), Frame("alien3.gif")]),
+    dict(key="otheralien", name="OtherAlien", size=(80, 71), topleft=(10, 10),
+         animcycle=12, sides=(1,), frames=[Frame("alienny2.png", (80, 71))] * 3),
+]
+ENEMIES = collections.OrderedDict(
+    (entry["key"], type(entry["name"], (Enemy,), dict(entry, images=[])))
+    for entry in ENEMY_TYPES
+)
+Plane = ENEMIES["plane"]
+Balloon = ENEMIES["balloon"]
+Alien = ENEMIES["alien"]
+OtherAlien = ENEMIES["otheralien"]
+
+
+class SpritePool:
+    """Keeps killed sprites of one class and game around to be brought back to life.
+
+    spawn() puts a pooled sprite back into its class 'containers' and
+    calls its reset() with the constructor arguments, and only creates
+    a new sprite when the pool is empty. At most 'cap' sprites are kept.
+    """
+
+    def __init__(self, cls, game, cap=POOL_SIZE):
+        self.cls = cls
+        self.game = game
+        self.cap = cap
+        self.free = []
+        self.allocated = 0
+        self.reused = 0
+        self.dropped = 0
+
+    def spawn(self, *args):
+        if not self.free:
+            self.allocated = self.allocated + 1
+            return self.cls(self.game, *args)
+        sprite = self.free.pop()
+        self.reused = self.reused + 1
+        sprite.add(self.game.groups(sprite))
+        sprite.reset(*args)
+        return sprite
+
+    def release(self, sprite):
+        if len(self.free) < self.cap:
+            self.free.append(sprite)
+        else:
+            self.dropped = self.dropped + 1
+
+    def stats(self):
+        return {
+            "allocated": self.allocated,
+            "reused": self.reused,
+            "dropped": self.dropped,
+            "free": len(self.free),
+        }
+
+
+class PooledSprite(pg.sprite.Sprite):
+    """A sprite that goes back to its game's pool for its class when killed.
+
+    Create these with spawn(game, ...) instead of calling the class, and
+    put the per-life setup in reset(), which spawn() calls on recycled
+    sprites. Subclasses set self.game in __init__.
+    """
+
+    @classmethod
+    def spawn(cls, game, *args):
+        pool = game.pools.get(cls)
+        if pool is None:
+            return cls(game, *args)
+        return pool.spawn(*args)
+
+    def kill(self):
+        alive = self.alive()
+        pg.sprite.Sprite.kill(self)
+        pool = self.game.pools.get(type(self))
+        if alive and pool is not None:
+            pool.release(self)
+
+
+class Explosion(PooledSprite):
     """An explosion. Hopefully the Alien and not the player!"""
 
     defaultlife = 12
     animcycle = 3
-    images = []
+    _layer = LAYER_EFFECTS
+    containers = ("all", "updated")
+    frames = [Frame("explosion1.gif"), Frame("explosion1.gif", flip=(1, 1))]
+    images = []  # the loaded 'frames'
+
+    def __init__(self, game, actor):
+        pg.sprite.Sprite.__init__(self, game.groups(self))
+        self.game = game
+        self.image = self.images[0]
+        self.rect = self.image.get_rect()
+        self.reset(actor)
 
-    def __init__(self, actor):
-        pg.sprite.Sprite.__init__(self, self.containers)
+    def reset(self, actor):
         self.image = self.images[0]
-        self.rect = self.image.get_rect(center=actor.rect.center)
+        self.rect.center = actor.rect.center
         self.life = self.defaultlife
 
     def update(self):
@@ -210,21 +837,29 @@ class Explosion(pg.sprite.Sprite):
         Also we animate the explosion.
         """
         self.life = self.life - 1
-        self.image = self.images[self.life // self.animcycle % 2]
+        self.image = self.images[self.life // self.animcycle % len(self.images)]
         if self.life <= 0:
             self.kill()
 
 
-class Shot(pg.sprite.Sprite):
+class Shot(PooledSprite):
     """a bullet the Player sprite fires."""
 
     speed = -11
-    images = []
-
-    def __init__(self, pos):
-        pg.sprite.Sprite.__init__(self, self.containers)
+    _layer = LAYER_PROJECTILES
+    containers = ("shots", "all", "updated")
+    frames = [Frame("shot.gif")]
+    images = []  # the loaded 'frames'
+
+    def __init__(self, game, pos):
+        pg.sprite.Sprite.__init__(self, game.groups(self))
+        self.game = game
         self.image = self.images[0]
-        self.rect = self.image.get_rect(midbottom=pos)
+        self.rect = self.image.get_rect()
+        self.reset(pos)
+
+    def reset(self, pos):
+        self.rect.midbottom = pos
 
     def update(self):
         """called every time around the game loop.
@@ -235,16 +870,28 @@ class Shot(pg.sprite.Sprite):
             self.kill()
 
 
-class Bomb(pg.sprite.Sprite):
+class Bomb(PooledSprite):
     """A bomb the aliens drop."""
 
     speed = 9
-    images = []
-
-    def __init__(self, alien):
-        pg.sprite.Sprite.__init__(self, self.containers)
+    floor = 470
+    _layer = LAYER_PROJECTILES
+    containers = ("bombs", "all", "updated")
+    frames = [Frame("bomb.gif")]
+    images = []  # the loaded 'frames'
+
+    def __init__(self, game, alien):
+        pg.sprite.Sprite.__init__(self, game.groups(self))
+        self.game = game
+        self.speed = game.speeds[Bomb]
         self.image = self.images[0]
-        self.rect = self.image.get_rect(midbottom=alien.rect.move(0, 5).midbottom)
+        self.rect = self.image.get_rect()
+        self.reset(alien)
+
+    def reset(self, alien):
+        self.rect.midbottom = alien.rect.centerx, alien.rect.bottom + 5
+        if self.game.engine:
+            self.game.engine.add(self, vy=self.speed, floor=self.floor)
 
     def update(self):
         """called every time around the game loop.
@@ -254,29 +901,70 @@ class Bomb(pg.sprite.Sprite):
         - remove the Bomb.
         """
         self.rect.move_ip(0, self.speed)
-        if self.rect.bottom >= 470:
-            Explosion(self)
-            self.kill()
+        if self.rect.bottom >= self.floor:
+            self.land()
+
+    def land(self):
+        # the pool may hand this bomb out again before the event is handled
+        self.game.events.push(BombLanded(self.rect.copy()))
+        self.kill()
+
+
+class GameState:
+    """The score and counters of one game.
+
+    Each game has its own, so several can run in one process. watch()
+    calls a function with the new value whenever a field changes, and
+    snapshot() and restore() save and put back every field at once.
+    """
+
+    __slots__ = ("score", "deaths", "tick", "born", "reload", "watchers")
+    fields = ("score", "deaths", "tick", "born", "reload")
+
+    def __init__(self, reload=0):
+        object.__setattr__(self, "watchers", {})
+        for name in self.fields:
+            object.__setattr__(self, name, 0)
+        self.reload = reload
+
+    def __setattr__(self, name, value):
+        watchers = self.watchers.get(name)
+        if watchers and value != getattr(self, name):
+            object.__setattr__(self, name, value)
+            for watcher in watchers:
+                watcher(value)
+        else:
+            object.__setattr__(self, name, value)
+
+    def watch(self, name, watcher):
+        """calls watcher(value) each time the field 'name' changes"""
+        self.watchers.setdefault(name, []).append(watcher)
+
+    def snapshot(self):
+        return tuple(getattr(self, name) for name in self.fields)
+
+    def restore(self, snapshot):
+        for name, value in zip(self.fields, snapshot):
+            setattr(self, name, value)
 
 
 class Score(pg.sprite.Sprite):
     """to keep track of the score."""
 
-    def __init__(self):
+    _layer = LAYER_HUD
+
+    def __init__(self, state):
         pg.sprite.Sprite.__init__(self)
         self.font = pg.font.Font(None, 20)
         self.font.set_italic(1)
         self.color = "white"
-        self.lastscore = -1
-        self.update()
+        self.render(state.score)
         self.rect = self.image.get_rect().move(10, 450)
+        # only drawn again when the score changes
+        state.watch("score", self.render)
 
-    def update(self):
-        """We only update the score in update() when it has changed."""
-        if SCORE != self.lastscore:
-            self.lastscore = SCORE
-            msg = "Score: %d" % SCORE
-            self.image = self.font.render(msg, 0, self.color)
+    def render(self, score):
+        self.image = self.font.render("Score: %d" % score, 0, self.color)
 
 # class StartKnapp(pg.sprite.Sprite):
 #     images = []
@@ -305,59 +993,1796 @@ class Score(pg.sprite.Sprite):
 #         self.rect = self.image.get_rect(center = (self.x, self.y))
 
 
-class BackgroundKlass(pg.sprite.Sprite):
+class ScrollingBackground:
+    """The scrolling background, drawn straight onto the screen.
 
-    images = []
+    This is not a sprite on purpose. As a screen sized sprite in the
+    'all' group it made every frame a full screen dirty rect, and the
+    sprites were erased with a background that got painted over anyway.
+    Instead draw() repaints the whole screen from the two wrapped strips
+    of the image that are in view, before the sprites are drawn. When
+    'speed' is 0 nothing moves, and the game uses it as the background
+    for normal dirty rectangle updates.
+    """
 
-    def __init__(self):
-        pg.sprite.Sprite.__init__(self, self.containers)
+    size = (SCREENRECT.width, SCREENRECT.height * 2)
+    frames = [Frame("background4.png", size)]
+    images = []  # the loaded 'frames'
+
+    def __init__(self, speed=SCROLL_SPEED):
         self.image = self.images[0]
-        self.image = pg.transform.scale(self.image, (SCREENRECT.width, SCREENRECT.height*2))
-        self.rect = pg.Rect(0, 0, SCREENRECT.width, SCREENRECT.height*2)
+        self.speed = speed
+        self.y = 0  # where the top of the image is on screen
 
     def update(self):
-        self.rect.move_ip(0, 3)
-        if(self.rect.y > 0):
-            self.rect.y = -self.rect.height//2
-    
+        self.y = (self.y + self.speed) % self.image.get_height()
+
+    def draw(self, surface, alpha=1.0):
+        """covers all of 'surface' with the background
+
+        'alpha' places it part way between the last two ticks, like the
+        Interpolator does for sprites.
+        """
+        height = self.image.get_height()
+        y = (self.y - int((1.0 - alpha) * self.speed)) % height
+        surface.blit(self.image, (0, 0), (0, height - y, surface.get_width(), y))
+        if y < surface.get_height():
+            surface.blit(self.image, (0, y))
 
 #button class
 class Button():
+	"""A menu button, driven by mouse events rather than polling the mouse.
+
+	handle() tracks whether the mouse is over the button or holding it
+	down, and sets 'changed' when that needs the button redrawn.
+	"""
 	def __init__(self, x, y, image, scale):
 		width = image.get_width()
 		height = image.get_height()
 		self.image = pg.transform.scale(image, (int(width * scale), int(height * scale)))
+		self.hover_image = self.image.copy()
+		self.hover_image.fill((40, 40, 40), special_flags=pg.BLEND_RGB_ADD)
 		self.rect = self.image.get_rect()
 		self.rect.topleft = (x, y)
 		self.clicked = False
+		self.hovered = False
+		self.changed = True
 
-	def draw(self, surface):
+	def handle(self, event):
+		"""returns True if 'event' clicked the button"""
 		action = False
-		#get mouse position
-		pos = pg.mouse.get_pos()
+		hovered = self.hovered
+		clicked = self.clicked
+		if event.type in (pg.MOUSEMOTION, pg.MOUSEBUTTONDOWN, pg.MOUSEBUTTONUP):
+			hovered = bool(self.rect.collidepoint(event.pos))
 
 		#check mouseover and clicked conditions
-		if self.rect.collidepoint(pos):
-			if pg.mouse.get_pressed()[0] == 1 and self.clicked == False:
-				self.clicked = True
+		if event.type == pg.MOUSEBUTTONDOWN and event.button == 1:
+			if hovered and not clicked:
+				clicked = True
 				action = True
+		elif event.type == pg.MOUSEBUTTONUP and event.button == 1:
+			clicked = False
 
-		if pg.mouse.get_pressed()[0] == 0:
-			self.clicked = False
+		if (hovered, clicked) != (self.hovered, self.clicked):
+			self.hovered = hovered
+			self.clicked = clicked
+			self.changed = True
+		return action
 
-		#draw button on screen
-		surface.blit(self.image, (self.rect.x, self.rect.y))
+	def reset(self, pos):
+		"""forgets any click, for when its menu is shown again"""
+		self.clicked = False
+		self.hovered = bool(self.rect.collidepoint(pos))
+		self.changed = True
+
+	def draw(self, surface, background=None):
+		"""draws the button, over 'background' if given, returns its rect"""
+		if background is not None:
+			surface.blit(background, self.rect, self.rect)
+		if self.hovered and not self.clicked:
+			surface.blit(self.hover_image, self.rect)
+		else:
+			surface.blit(self.image, self.rect)
+		self.changed = False
+		return self.rect
+
+
+class SpatialHash:
+    """A uniform grid of buckets over the screen, for collision broadphase.
+
+    Instead of testing every enemy against every shot, like
+    pg.sprite.groupcollide does, each sprite is filed under the grid cells
+    its rect touches and only sprites sharing a cell get tested. sync()
+    only refiles sprites that crossed into other cells since last frame,
+    so collision cost grows with the number of sprites, not its square.
+
+    Like the pg.sprite collide functions, 'collided' can be given a
+    narrowphase test such as collide_mask, called only for rect hits.
+    """
+
+    def __init__(self, cellsize=64, collided=None):
+        self.cellsize = cellsize
+        self.collided = collided
+        self.grids = {}  # group: {(x, y): set of sprites}
+        self.spans = {}  # sprite: (cells, span)
+
+    def span(self, rect):
+        """the (left, top, right, bottom) cells a rect touches"""
+        size = self.cellsize
+        return (
+            rect.left // size,
+            rect.top // size,
+            (rect.right - 1) // size,
+            (rect.bottom - 1) // size,
+        )
+
+    def file(self, sprite, cells):
+        span = self.span(sprite.rect)
+        old = self.spans.get(sprite)
+        if old is not None:
+            if old[1] == span:
+                return
+            self.unfile(sprite)
+        self.spans[sprite] = cells, span
+        left, top, right, bottom = span
+        for x in range(left, right + 1):
+            for y in range(top, bottom + 1):
+                cells[x, y].add(sprite)
+
+    def unfile(self, sprite):
+        cells, (left, top, right, bottom) = self.spans.pop(sprite)
+        for x in range(left, right + 1):
+            for y in range(top, bottom + 1):
+                cell = cells[x, y]
+                cell.discard(sprite)
+                if not cell:
+                    del cells[x, y]
+
+    def kill(self, sprite):
+        sprite.kill()
+        if sprite in self.spans:
+            self.unfile(sprite)
+
+    def sync(self, *groups):
+        """refiles the sprites in 'groups' and forgets the dead ones"""
+        for sprite in [s for s in self.spans if not s.alive()]:
+            self.unfile(sprite)
+        for group in groups:
+            cells = self.grids.get(group)
+            if cells is None:
+                cells = self.grids[group] = collections.defaultdict(set)
+            for sprite in group:
+                self.file(sprite, cells)
+
+    def query(self, sprite, group):
+        """returns the sprites in 'group' that 'sprite' collides with"""
+        cells = self.grids.get(group)
+        if not cells:
+            return []
+        rect = sprite.rect
+        left, top, right, bottom = self.span(rect)
+        found = set()
+        for x in range(left, right + 1):
+            for y in range(top, bottom + 1):
+                cell = cells.get((x, y))
+                if cell:
+                    found.update(cell)
+        hits = [s for s in found if s in group and rect.colliderect(s.rect)]
+        if self.collided and hits:
+            hits = [s for s in hits if self.collided(sprite, s)]
+        return hits
+
+    def collide(self, player, enemygroups, shots, bombs, dokill=True):
+        """Finds all of this frame's hits in one pass over the grid.
+
+        Gives the same hits as spritecollide(player, group, 1) for each
+        enemy group, then groupcollide(group, shots, 1, 1) for each enemy
+        group, then spritecollide(player, bombs, 1). Returns a list of
+        (group, enemy) that crashed into the player, a list of (group,
+        enemy) that got shot and a list of bombs that hit the player.
+        """
+        crashed = []
+        for group in enemygroups:
+            for enemy in self.query(player, group):
+                crashed.append((group, enemy))
+                if dokill:
+                    self.kill(enemy)
+
+        shot = []
+        for group in enemygroups:
+            if not shots:
+                break
+            for enemy in group.sprites():
+                hits = self.query(enemy, shots)
+                if hits:
+                    shot.append((group, enemy))
+                    if dokill:
+                        self.kill(enemy)
+                        for hit in hits:
+                            self.kill(hit)
+
+        bombed = self.query(player, bombs)
+        if dokill:
+            for bomb in bombed:
+                self.kill(bomb)
+        return crashed, shot, bombed
+
+
+class MoverArrays:
+    """The rects, speeds and animation state of one group's sprites.
+
+    Sprites register with add() when they spawn, and the ones that were
+    killed are dropped at the start of the next step(). A sprite that was
+    killed and brought back by its pool before then reuses its old row.
+    Each sprite's rect is written to in place, so it must keep the same
+    Rect object while it is registered.
+    """
+
+    fields = ("x", "y", "w", "h", "vx", "vy", "frame", "cycle", "frames",
+              "bounce", "floor")
+
+    def __init__(self, group):
+        self.group = group
+        self.sprites = []
+        self.rects = []
+        self.index = {}
+        self.pending = []
+        for name in self.fields:
+            setattr(self, name, np.zeros(0, np.int64))
+
+    def add(self, sprite, vx=0, vy=0, bounce=False, floor=0, cycle=0, frames=1):
+        rect = sprite.rect
+        row = (rect.x, rect.y, rect.w, rect.h, vx, vy, 0, cycle, frames,
+               bounce, floor)
+        i = self.index.get(sprite)
+        if i is None:
+            self.index[sprite] = len(self.sprites) + len(self.pending)
+            self.pending.append((sprite, row))
+        elif i >= len(self.sprites):
+            self.pending[i - len(self.sprites)] = sprite, row
+        else:
+            for name, value in zip(self.fields, row):
+                getattr(self, name)[i] = value
+
+    def sync(self):
+        """takes in the newly added sprites and drops the dead ones"""
+        if self.pending:
+            sprites, rows = zip(*self.pending)
+            self.sprites.extend(sprites)
+            self.rects.extend(sprite.rect for sprite in sprites)
+            columns = np.array(rows, np.int64).T
+            for name, column in zip(self.fields, columns):
+                setattr(self, name, np.concatenate((getattr(self, name), column)))
+            self.pending = []
+        if len(self.sprites) != len(self.group):
+            keep = np.fromiter(
+                (s.alive() for s in self.sprites), bool, len(self.sprites)
+            )
+            self.sprites = [s for s, alive in zip(self.sprites, keep) if alive]
+            self.rects = [s.rect for s in self.sprites]
+            for name in self.fields:
+                setattr(self, name, getattr(self, name)[keep])
+            self.index = dict((s, i) for i, s in enumerate(self.sprites))
+
+    def step(self):
+        """does what update() would do for every sprite in the group"""
+        self.sync()
+        if not self.sprites:
+            return
+        area = SCREENRECT
+        self.x += self.vx
+        self.y += self.vy
+
+        # bouncers turn around and drop a row when they leave the screen
+        out = (self.bounce != 0) & (
+            (self.x < area.left)
+            | (self.y < area.top)
+            | (self.x + self.w > area.right)
+            | (self.y + self.h > area.bottom)
+        )
+        if out.any():
+            self.vx[out] = -self.vx[out]
+            self.y[out] += self.h[out] + 1
+            self.x[out] = self.clamp(self.x[out], self.w[out], area.left, area.width)
+            self.y[out] = self.clamp(self.y[out], self.h[out], area.top, area.height)
+
+        # animate, and only swap the images of sprites that changed frame
+        self.frame += 1
+        cycle = np.maximum(self.cycle, 1)
+        shown = self.frame // cycle % self.frames
+        changed = (self.cycle != 0) & (shown != (self.frame - 1) // cycle % self.frames)
+        for i, image in zip(np.flatnonzero(changed).tolist(), shown[changed].tolist()):
+            sprite = self.sprites[i]
+            sprite.image = sprite.images[image]
+
+        # write back only the coordinates that changed, most sprites only
+        # move along one axis
+        rects = self.rects
+        rows = np.flatnonzero((self.vx != 0) | out)
+        if len(rows) == len(rects):
+            for rect, x in zip(rects, self.x.tolist()):
+                rect.x = x
+        else:
+            for i, x in zip(rows.tolist(), self.x[rows].tolist()):
+                rects[i].x = x
+        rows = np.flatnonzero((self.vy != 0) | out)
+        if len(rows) == len(rects):
+            for rect, y in zip(rects, self.y.tolist()):
+                rect.y = y
+        else:
+            for i, y in zip(rows.tolist(), self.y[rows].tolist()):
+                rects[i].y = y
+
+        # fallers land when they reach their floor
+        landed = (self.floor != 0) & (self.y + self.h >= self.floor)
+        for i in np.flatnonzero(landed).tolist():
+            self.sprites[i].land()
+
+    @staticmethod
+    def clamp(pos, size, start, length):
+        """Rect.clamp along one axis, for arrays"""
+        return np.where(
+            size >= length,
+            start + length // 2 - size // 2,
+            np.clip(pos, start, start + length - size),
+        )
+
+
+class MoverEngine:
+    """Moves aliens, planes, balloons and bombs a whole group at a time.
+
+    The per-sprite update() of these classes does the same few rect
+    operations for every sprite, which gets slow with thousands of them.
+    With an engine as their game's 'engine' the sprites are kept out of
+    its 'updated' group and register with the engine instead, which keeps
+    their state in numpy arrays and advances every group in one step(),
+    writing back only the rects and images needed for drawing.
+    """
+
+    def __init__(self, groups):
+        """'groups' maps each sprite class to the group its sprites go in"""
+        self.classes = {}
+        self.arrays = []
+        for cls, group in groups.items():
+            for arrays in self.arrays:
+                if arrays.group is group:
+                    break
+            else:
+                arrays = MoverArrays(group)
+                self.arrays.append(arrays)
+            self.classes[cls] = arrays
+
+    def add(self, sprite, **kwargs):
+        self.classes[type(sprite)].add(sprite, **kwargs)
+
+    def step(self):
+        for arrays in self.arrays:
+            arrays.step()
+
+
+class Interpolator:
+    """Draws sprites part way between where the last two ticks put them.
+
+    When frames are drawn at a different rate than the game ticks, drawing
+    sprites just where the last tick left them makes motion judder.
+    snapshot() remembers where the sprites are before each tick, and
+    draw() moves every sprite that moved to 'alpha' of the way from there
+    to its current position, draws the group and puts the rects back.
+    Sprites that jumped further than 'maxjump', like a recycled shot
+    coming back at the player's gun, are drawn where they are.
+    """
+
+    def __init__(self, maxjump=64):
+        self.maxjump = maxjump
+        self.previous = {}
+
+    def snapshot(self, group):
+        self.previous = dict((s, s.rect.topleft) for s in group)
+
+    def draw(self, group, surface, alpha):
+        moved = []
+        if alpha < 1.0:
+            for sprite, (oldx, oldy) in self.previous.items():
+                rect = sprite.rect
+                x, y = rect.topleft
+                dx = x - oldx
+                dy = y - oldy
+                if (dx or dy) and abs(dx) + abs(dy) <= self.maxjump:
+                    moved.append((rect, x, y))
+                    rect.topleft = x - int((1.0 - alpha) * dx), y - int((1.0 - alpha) * dy)
+        dirty = group.draw(surface)
+        for rect, x, y in moved:
+            rect.topleft = x, y
+        return dirty
+
+
+class BatchedUpdates(pg.sprite.LayeredUpdates):
+    """A LayeredUpdates that draws with one Surface.blits call.
+
+    Sprites are kept sorted by their class's _layer, so one blits() call
+    draws them all bottom layer first, and clear() erases them with
+    another. draw() returns the same dirty rects RenderUpdates would: the
+    new rect of every sprite, joined with its old one when they overlap.
+    """
+
+    def draw(self, surface, bgsurf=None, special_flags=0):
+        sprites = self.sprites()
+        spritedict = self.spritedict
+        old = [spritedict[sprite] for sprite in sprites]
+        new = surface.blits(
+            [(sprite.image, sprite.rect, None, special_flags) for sprite in sprites]
+        )
+        spritedict.update(zip(sprites, new))
+        dirty = self.lostsprites
+        self.lostsprites = []
+        for oldrect, newrect in zip(old, new):
+            if not oldrect:
+                dirty.append(newrect)
+            elif newrect.colliderect(oldrect):
+                dirty.append(newrect.union(oldrect))
+            else:
+                dirty.append(newrect)
+                dirty.append(oldrect)
+        return dirty
+
+    def clear(self, surface, bgd):
+        rects = self.lostsprites + [rect for rect in self.spritedict.values() if rect]
+        surface.blits([(bgd, rect, rect) for rect in rects], doreturn=False)
+
+
+class DirtyRegions:
+    """Gets each drawn frame onto the display, as cheaply as it can.
+
+    The dirty rects are merged on a grid of 'tile' pixel squares: every
+    tile a rect touches is marked, runs of marked tiles in a row become
+    one rect, and rects with the same run in the rows below grow down.
+    However many sprites overlap, the display gets a few rects and each
+    pixel once. Then it times both kinds of update as they happen, and
+    pushes the merged rects or flips the whole screen, whichever should
+    cost less. Until both have been timed it flips when more than
+    'flip_area' of the screen is dirty, and after 'recheck' frames done
+    one way it does one the other way, to keep both timings current.
+    """
+
+    smoothing = 0.1  # weight of the newest timing in the running averages
+    recheck = 120
+
+    def __init__(self, size=SCREENRECT.size, tile=32, flip_area=0.5):
+        self.screen = pg.Rect((0, 0), size)
+        self.tile = tile
+        self.rows = -(-size[1] // tile)
+        self.flip_area = flip_area
+        self.flip_cost = None  # seconds for a flip
+        self.pixel_cost = None  # seconds per pixel for an update
+        self.frames = self.flips = self.updates = 0
+        self.pixels = self.rects_in = self.rects_out = 0
+        self.last_pixels = 0
+        self.streak = 0  # frames in a row pushed the same way
+        self.flipped = False
+
+    def merge(self, rects):
+        """the rects covering every tile that 'rects' touch"""
+        tile = self.tile
+        rows = [0] * self.rows
+        for rect in rects:
+            rect = rect.clip(self.screen)
+            if not rect:
+                continue
+            left = rect.left // tile
+            bits = ((1 << ((rect.right - 1) // tile - left + 1)) - 1) << left
+            for y in range(rect.top // tile, (rect.bottom - 1) // tile + 1):
+                rows[y] = rows[y] | bits
+        merged = []
+        growing = {}
+        for y, bits in enumerate(rows):
+            spans = {}
+            x = 0
+            while bits:
+                if bits & 1:
+                    start = x
+                    while bits & 1:
+                        bits = bits >> 1
+                        x = x + 1
+                    rect = growing.get((start, x))
+                    if rect:
+                        rect.height = rect.height + tile
+                    else:
+                        rect = pg.Rect(start * tile, y * tile, (x - start) * tile, tile)
+                        merged.append(rect)
+                    spans[start, x] = rect
+                else:
+                    bits = bits >> 1
+                    x = x + 1
+            growing = spans
+        return [rect.clip(self.screen) for rect in merged]
+
+    def average(self, old, new):
+        if old is None:
+            return new
+        return old + self.smoothing * (new - old)
+
+    def flip(self):
+        """pushes the whole screen"""
+        started = time.perf_counter()
+        pg.display.flip()
+        self.flip_cost = self.average(self.flip_cost, time.perf_counter() - started)
+        self.flips = self.flips + 1
+        self.last_pixels = self.screen.width * self.screen.height
+        self.pixels = self.pixels + self.last_pixels
+
+    def present(self, dirty, full=False):
+        """pushes a drawn frame, 'full' when all of it changed"""
+        self.frames = self.frames + 1
+        if full:
+            self.flip()
+            return
+        rects = self.merge(dirty)
+        pixels = sum(rect.width * rect.height for rect in rects)
+        self.rects_in = self.rects_in + len(dirty)
+        self.rects_out = self.rects_out + len(rects)
+        if self.flip_cost is None or self.pixel_cost is None:
+            flip = pixels > self.flip_area * self.screen.width * self.screen.height
+        else:
+            flip = pixels * self.pixel_cost > self.flip_cost
+        self.streak = self.streak + 1 if flip == self.flipped else 0
+        self.flipped = flip
+        if self.streak >= self.recheck:
+            flip = not flip
+            self.streak = 0
+        if flip:
+            self.flip()
+            return
+        started = time.perf_counter()
+        pg.display.update(rects)
+        if pixels:
+            self.pixel_cost = self.average(
+                self.pixel_cost, (time.perf_counter() - started) / pixels
+            )
+        self.updates = self.updates + 1
+        self.last_pixels = pixels
+        self.pixels = self.pixels + pixels
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "flips": self.flips,
+            "updates": self.updates,
+            "pixels": self.pixels,
+            "pixels_per_frame": self.pixels / max(self.frames, 1),
+            "rects_in": self.rects_in,
+            "rects_out": self.rects_out,
+        }
+
+
+class SoundBoard:
+    """Plays the sound effects on a fixed set of mixer channels.
+
+    Each effect in EFFECTS gets at most its number of voices, and a new
+    one replaces its own oldest voice rather than going over. When every
+    channel is busy it takes the oldest voice of the lowest priority
+    effect, as long as that is no higher than its own, or isn't played.
+    An effect played more than once in a frame is only played once, the
+    copies would just be louder. end_frame() starts the next frame.
+
+    The sounds are decoded once at load time into the mixer's format,
+    MIXER_FORMAT, so playing them does no conversion.
+    """
+
+    def __init__(self, effects=EFFECTS, channels=MIXER_CHANNELS):
+        self.effects = effects
+        self.sounds = {}
+        self.channels = []
+        if pg.mixer:
+            for name, (file, priority, voices) in effects.items():
+                self.sounds[name] = load_sound(file)
+            pg.mixer.set_num_channels(channels)
+            self.channels = [pg.mixer.Channel(i) for i in range(channels)]
+        self.voices = {}  # channel: (effect name, priority, when started)
+        self.fired = set()
+        self.count = 0
+        self.played = self.merged = self.replaced = self.stolen = self.dropped = 0
+
+    def play(self, name):
+        sound = self.sounds.get(name)
+        if sound is None:
+            return
+        if name in self.fired:
+            self.merged = self.merged + 1
+            return
+        self.fired.add(name)
+        file, priority, voices = self.effects[name]
+        playing = dict(
+            (channel, voice) for channel, voice in self.voices.items() if channel.get_busy()
+        )
+        mine = [channel for channel, voice in playing.items() if voice[0] == name]
+        free = [channel for channel in self.channels if channel not in playing]
+        if len(mine) >= voices:
+            channel = min(mine, key=lambda channel: playing[channel][2])
+            self.replaced = self.replaced + 1
+        elif free:
+            channel = free[0]
+        else:
+            channel = min(playing, key=lambda channel: playing[channel][1:])
+            if playing[channel][1] > priority:
+                self.dropped = self.dropped + 1
+                return
+            self.stolen = self.stolen + 1
+        self.count = self.count + 1
+        self.voices[channel] = (name, priority, self.count)
+        channel.play(sound)
+        self.played = self.played + 1
+
+    def end_frame(self):
+        self.fired.clear()
+
+    def stats(self):
+        return {
+            "played": self.played,
+            "merged": self.merged,
+            "replaced": self.replaced,
+            "stolen": self.stolen,
+            "dropped": self.dropped,
+        }
+
+
+# The things that happen in a tick, queued on the EventBus as they are
+# found and handled together at the end of the tick. An event with a
+# 'rect' can be passed to Explosion.spawn() like a sprite.
+Hit = collections.namedtuple("Hit", "enemy by")  # by the "shot" or "player"
+PlayerDeath = collections.namedtuple("PlayerDeath", "player cause")  # enemy or bomb
+BombLanded = collections.namedtuple("BombLanded", "rect")
+ShotFired = collections.namedtuple("ShotFired", "pos")
+
+
+class EventBus:
+    """Queues game events during a tick, and hands them out in batches.
+
+    Collision and update code push() events instead of playing sounds,
+    spawning explosions and adding up the score on the spot. drain() then
+    calls every handler subscribed to a kind of event once, with the list
+    of them, in the order the kinds were subscribed. 'counts' adds up
+    how many of each kind there were.
+    """
 
-		return action   
+    def __init__(self):
+        self.handlers = collections.OrderedDict()  # kind: [handler]
+        self.queues = collections.OrderedDict()  # kind: [event]
+        self.counts = collections.Counter()
+
+    def subscribe(self, kind, handler):
+        self.handlers.setdefault(kind, []).append(handler)
+        self.queues.setdefault(kind, [])
+
+    def push(self, event):
+        self.queues.setdefault(type(event), []).append(event)
+
+    def drain(self):
+        for kind, queue in self.queues.items():
+            if queue:
+                events = queue[:]
+                del queue[:]
+                self.counts[kind.__name__] += len(events)
+                for handler in self.handlers.get(kind, ()):
+                    handler(events)
+
+
+class GameLog:
+    """A recording of one game, compact enough to keep lots of them.
+
+    The file holds a header with the seed, the enemy picked in the menu
+    and the game constants that change how a game plays out, then the
+    keys held on every tick as runs of (ticks, keys) pairs, then the
+    number of ticks, the final score and a digest of where every sprite
+    ended up, to check a replay against.
+    """
+
+    magic = b"ALIENLG2"
+    header = struct.Struct("<8sIB7h")
+    # recordings from before the speeds were settings play at 100%
+    old_headers = {b"ALIENLOG": struct.Struct("<8sIB5h")}
+    run = struct.Struct("<HB")
+    footer = struct.Struct("<IiI")
+    # None first and new kinds last, so old recordings keep their index
+    enemies = (None,) + tuple(ENEMIES)
+    keys = (pg.K_LEFT, pg.K_RIGHT, pg.K_SPACE)
+
+    def __init__(self, seed, enemy, constants):
+        if not 0 <= seed < 1 << 32:
+            raise ValueError("can't record seed %d, it must fit 32 bits" % seed)
+        for name, value in zip(Settings._fields, constants):
+            if not -1 << 15 <= value < 1 << 15:
+                raise ValueError("can't record %s %d, it must fit 16 bits" % (name, value))
+        self.seed = seed
+        self.enemy = enemy
+        self.constants = constants
+        self.runs = []
+        self.ticks = 0
+        self.score = 0
+        self.digest = 0
+
+    def add(self, keystate):
+        """records the keys held for one tick"""
+        code = 0
+        for bit, key in enumerate(self.keys):
+            if keystate[key]:
+                code = code | 1 << bit
+        if self.runs and self.runs[-1][1] == code and self.runs[-1][0] < 0xFFFF:
+            self.runs[-1][0] = self.runs[-1][0] + 1
+        else:
+            self.runs.append([1, code])
+        self.ticks = self.ticks + 1
+
+    def end(self, game):
+        """records how 'game' ended, to check a replay against"""
+        self.score = game.state.score
+        self.digest = state_digest(game.all)
+
+    def controls(self):
+        """returns a get_pressed() source that plays the keys back"""
+        return ReplayInput(self)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.header.pack(
+                self.magic, self.seed, self.enemies.index(self.enemy), *self.constants
+            ))
+            f.write(struct.pack("<I", len(self.runs)))
+            for count, code in self.runs:
+                f.write(self.run.pack(count, code))
+            f.write(self.footer.pack(self.ticks, self.score, self.digest))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        header = cls.old_headers.get(data[:8], cls.header)
+        fields = header.unpack_from(data)
+        if fields[0] != cls.magic and fields[0] not in cls.old_headers:
+            raise SystemExit('"%s" is not a game recording' % path)
+        log = cls(fields[1], cls.enemies[fields[2]], Settings(*fields[3:]))
+        offset = header.size
+        (count,) = struct.unpack_from("<I", data, offset)
+        offset = offset + 4
+        for i in range(count):
+            log.runs.append(list(cls.run.unpack_from(data, offset)))
+            offset = offset + cls.run.size
+        log.ticks, log.score, log.digest = cls.footer.unpack_from(data, offset)
+        return log
+
+
+class ReplayInput:
+    """Stands in for pg.key.get_pressed(), playing back a GameLog."""
+
+    def __init__(self, log):
+        self.codes = (code for count, code in log.runs for i in range(count))
+        self.keys = log.keys
+
+    def get_pressed(self):
+        code = next(self.codes, 0)
+        keystate = collections.defaultdict(int)
+        for bit, key in enumerate(self.keys):
+            keystate[key] = code >> bit & 1
+        return keystate
+
+
+def state_digest(group):
+    """a checksum of the kind and place of every game sprite in 'group'
+
+    The score and profile overlay on LAYER_HUD are left out, they only
+    show the game and can come and go while it is played.
+    """
+    state = sorted(
+        (type(s).__name__, tuple(s.rect))
+        for s in group if getattr(s, "_layer", 0) != LAYER_HUD
+    )
+    return zlib.crc32(repr(state).encode())
+
+
+# The constants that change how a game plays out, which a recording has
+# to be replayed with. Each Game has its own.
+# The speeds are percentages of each sprite class's own.
+Settings = collections.namedtuple(
+    "Settings",
+    "max_shots alien_odds bomb_odds alien_reload pixel_perfect enemy_speed bomb_speed",
+)
+Settings.__new__.__defaults__ = (100, 100)
+
+
+def game_constants(**changes):
+    """the module constants, as the command line set them, as Settings
+    with 'changes' made"""
+    return Settings(
+        MAX_SHOTS, ALIEN_ODDS, BOMB_ODDS, ALIEN_RELOAD, PIXEL_PERFECT,
+        ENEMY_SPEED, BOMB_SPEED,
+    )._replace(**changes)
+
+
+def replay(path):
+    """Replays a recorded game headless, as fast as it goes.
+
+    Returns True if it ended with the same score and sprites.
+    """
+    log = GameLog.load(path)
+    stats = main(headless=True, frames=log.ticks, seed=log.seed,
+                 enemy=log.enemy, controls=log.controls(), settings=log.constants)
+    same = stats["score"] == log.score and stats["digest"] == log.digest
+    print("replayed %d ticks in %.2fs: score %d (recorded %d), %s" % (
+        stats["frames"], stats["seconds"], stats["score"], log.score,
+        "same ending" if same else "DIFFERENT ending"))
+    return same
+
+
+class ScriptedInput:
+    """Stands in for pg.key.get_pressed() when running headless.
+
+    Wanders left and right and keeps pulling the trigger, so a benchmark
+    run exercises shots, collisions and explosions like a real player.
+    """
+
+    def __init__(self, seed=None):
+        self.rng = random.Random(seed)
+        self.direction = 1
+
+    def get_pressed(self):
+        if not self.rng.randrange(30):
+            self.direction = self.rng.choice((-1, 0, 1))
+        keystate = collections.defaultdict(int)
+        keystate[pg.K_LEFT] = self.direction < 0
+        keystate[pg.K_RIGHT] = self.direction > 0
+        keystate[pg.K_SPACE] = self.rng.randrange(2)
+        return keystate
+
+
+class BotInput:
+    """Stands in for pg.key.get_pressed() with a player that tries.
+
+    Steps out from under the nearest falling bomb, otherwise lines up
+    under the nearest enemy and fires when it is close. 'player' is
+    called for the current Player, as it is replaced after dying.
+    """
+
+    def __init__(self, player, enemygroups, bombs):
+        self.player = player
+        self.enemygroups = enemygroups
+        self.bombs = bombs
+
+    def get_pressed(self):
+        rect = self.player().rect
+        direction = fire = 0
+        danger = [b.rect for b in self.bombs
+                  if b.rect.bottom < rect.top and abs(b.rect.centerx - rect.centerx) < rect.width]
+        if danger:
+            bomb = max(danger, key=lambda r: r.bottom)
+            direction = 1 if bomb.centerx < rect.centerx else -1
+        else:
+            enemies = [s.rect for group in self.enemygroups for s in group]
+            if enemies:
+                target = min(enemies, key=lambda r: abs(r.centerx - rect.centerx))
+                offset = target.centerx - rect.centerx
+                if abs(offset) > rect.width // 4:
+                    direction = 1 if offset > 0 else -1
+                fire = abs(offset) < rect.width
+        keystate = collections.defaultdict(int)
+        keystate[pg.K_LEFT] = direction < 0
+        keystate[pg.K_RIGHT] = direction > 0
+        keystate[pg.K_SPACE] = fire
+        return keystate
+
+
+class PhaseTimer:
+    """Adds up the wall time spent in each phase of the main loop.
+
+    The time of each phase in the last 'window' frames is kept too, for
+    percentiles. With 'trace' set to a file name every lap is also written
+    there as Chrome trace events (chrome://tracing or ui.perfetto.dev open
+    them), 'flush' laps at a time, so a long session takes no more memory
+    and a crash loses only the last few frames. The file is a JSON array,
+    which the trace viewers open even when close_trace() never ran.
+    """
+
+    def __init__(self, window=600, trace=None, flush=1000):
+        self.totals = collections.OrderedDict()
+        self.window = window
+        self.samples = collections.OrderedDict()
+        self.frame = collections.OrderedDict()
+        self.flush = flush
+        self.events = None  # the laps not yet written to 'trace'
+        self.trace = None
+        if trace:
+            self.events = []
+            self.trace = open(trace, "w")
+            self.trace.write("[")
+            self.separator = "\n"
+        self.origin = self.first = self.last = time.perf_counter()
+
+    def start(self):
+        self.first = self.last = time.perf_counter()
+
+    def lap(self, phase):
+        """charge the time since the last lap to 'phase'"""
+        now = time.perf_counter()
+        self.totals[phase] = self.totals.get(phase, 0.0) + now - self.last
+        self.frame[phase] = self.frame.get(phase, 0.0) + now - self.last
+        if self.events is not None:
+            self.events.append((phase, self.last, now))
+        self.last = now
+
+    def end_frame(self):
+        """file this frame's phase times with the last 'window' frames"""
+        self.frame["frame"] = self.last - self.first
+        if self.events is not None:
+            self.events.append(("frame", self.first, self.last))
+            if len(self.events) >= self.flush:
+                self.write_trace()
+        for phase, seconds in self.frame.items():
+            if phase not in self.samples:
+                self.samples[phase] = collections.deque(maxlen=self.window)
+            self.samples[phase].append(seconds)
+        self.frame = collections.OrderedDict()
+
+    def percentiles(self, points=(50, 95, 99)):
+        """{phase: [milliseconds at each percentile]} over the window"""
+        result = collections.OrderedDict()
+        for phase, samples in self.samples.items():
+            ordered = sorted(samples)
+            result[phase] = [
+                1000.0 * ordered[min(len(ordered) - 1, len(ordered) * point // 100)]
+                for point in points
+            ]
+        return result
+
+    def write_trace(self):
+        """writes the laps kept so far as Chrome trace events"""
+        for phase, start, end in self.events:
+            self.trace.write(self.separator + json.dumps(
+                {"name": phase, "ph": "X", "pid": 1, "tid": 2 if phase == "frame" else 1,
+                 "ts": 1e6 * (start - self.origin), "dur": 1e6 * (end - start)}
+            ))
+            self.separator = ",\n"
+        self.trace.flush()
+        del self.events[:]
+
+    def close_trace(self):
+        """writes the last laps and ends the trace file"""
+        self.write_trace()
+        self.trace.write("\n]\n")
+        self.trace.close()
+        self.events = self.trace = None
+
+
+class ProfileOverlay(pg.sprite.Sprite):
+    """Shows p50/p95/p99 milliseconds of each phase of the main loop."""
+
+    interval = 20
+    _layer = LAYER_HUD
+
+    def __init__(self, timer):
+        pg.sprite.Sprite.__init__(self)
+        self.timer = timer
+        self.font = pg.font.Font(None, 18)
+        self.color = "white"
+        self.lasttext = None
+        self.countdown = 0
+        self.update()
 
+    def update(self):
+        """We only render the text again when it has changed, and check
+        for changes every 'interval' ticks so it stays readable."""
+        if self.countdown:
+            self.countdown = self.countdown - 1
+            return
+        self.countdown = self.interval
+        lines = ["%-8s %5s %5s %5s" % ("ms", "p50", "p95", "p99")]
+        for phase, values in self.timer.percentiles().items():
+            lines.append("%-8s %5.1f %5.1f %5.1f" % ((phase,) + tuple(values)))
+        if lines == self.lasttext:
+            return
+        self.lasttext = lines
+        rendered = [self.font.render(line, 0, self.color) for line in lines]
+        height = self.font.get_linesize()
+        self.image = pg.Surface(
+            (max(text.get_width() for text in rendered), height * len(rendered)),
+            pg.SRCALPHA,
+        )
+        for i, text in enumerate(rendered):
+            self.image.blit(text, (0, i * height))
+        self.rect = self.image.get_rect(topright=(SCREENRECT.right - 10, 10))
+
+
+def print_stats(stats):
+    """prints the numbers main() returns when running headless"""
+    print("%(frames)d frames in %(seconds).2fs: %(fps).1f fps" % stats)
+    percentiles = stats["percentiles"]
+    for phase, seconds in stats["phases"].items():
+        print(
+            "  %-8s %8.3f ms/frame, p50/p95/p99 %.3f/%.3f/%.3f ms"
+            % ((phase, 1000.0 * seconds / max(stats["frames"], 1))
+               + tuple(percentiles[phase]))
+        )
+    if "frame" in percentiles:
+        print("  whole frame p50/p95/p99 %.3f/%.3f/%.3f ms"
+              % tuple(percentiles["frame"]))
+    print("  peak sprites: %s" % ", ".join(
+        "%s=%d" % item for item in stats["peaks"].items()))
+    print("  score %(score)d, deaths %(deaths)d" % stats)
+    print("  asset cache: %(hits)d hits, %(misses)d misses, %(bytes)d bytes"
+          % stats["assets"])
+    for name, pool in stats["pools"].items():
+        print("  %s pool: %d allocated, %d reused, %d dropped"
+              % (name, pool["allocated"], pool["reused"], pool["dropped"]))
+    print("  sounds: %(played)d played, %(merged)d merged into one, %(replaced)d"
+          " replaced their own oldest voice, %(stolen)d stolen, %(dropped)d dropped"
+          % stats["sounds"])
+    print("  events: %s" % ", ".join(
+        "%s=%d" % item for item in sorted(stats["events"].items())))
+    print("  display: %(flips)d flips, %(updates)d updates, %(pixels_per_frame).0f"
+          " pixels/frame, %(rects_in)d dirty rects merged to %(rects_out)d"
+          % stats["display"])
+
+
+# The Settings fields sweep() can vary. The speeds are percentages of
+# each class's own speed.
+SWEEP_PARAMS = (
+    "max_shots", "alien_odds", "bomb_odds", "alien_reload", "enemy_speed", "bomb_speed",
+)
+
+
+def sweep_settings():
+    """the current value of every Settings field a sweep can vary"""
+    constants = game_constants()
+    return dict((name, getattr(constants, name)) for name in SWEEP_PARAMS)
+
+
+def sweep_game(job):
+    """Plays one headless game of a sweep, in a worker process.
+
+    The game constants and options come with the job, since a worker
+    started by spawn or forkserver never ran the command line that set
+    the module globals.
+    """
+    global NUMPY_MOVERS, POOL_SIZE
+    settings, constants, options, seed, frames, enemy, bot = job
+    NUMPY_MOVERS, POOL_SIZE = options
+    stats = main(headless=True, frames=frames, seed=seed, enemy=enemy, bot=bot,
+                 settings=constants._replace(**settings))
+    return settings, stats
+
+
+def sweep(grid, games=20, frames=2000, enemy="alien", bot=False,
+          path="sweep.csv", jobs=None, seed=0):
+    """Plays 'games' headless games for every combination in 'grid'.
+
+    'grid' maps SWEEP_PARAMS to the values to try, anything not in
+    it keeps its current value. Speeds are percentages of each class's
+    own, so enemy_speed=50,100 tries every kind at half and full speed.
+    Game i of every combination is seeded with seed + i, as in simulate(). The games run across a pool of 'jobs'
+    processes, each with its own pygame, and one row of averages per
+    combination is written to the CSV file 'path'.
+    """
+    names = sorted(grid)
+    base = sweep_settings()
+    constants = game_constants()
+    options = NUMPY_MOVERS, POOL_SIZE
+    jobs_list = []
+    for values in itertools.product(*(grid[name] for name in names)):
+        settings = dict(base, **dict(zip(names, values)))
+        for i in range(games):
+            jobs_list.append((settings, constants, options, seed + i, frames, enemy, bot))
+
+    results = collections.OrderedDict()
+    started = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        chunksize = max(1, len(jobs_list) // (4 * (jobs or os.cpu_count() or 1)))
+        for i, (settings, stats) in enumerate(
+                pool.map(sweep_game, jobs_list, chunksize=chunksize)):
+            key = tuple(settings[name] for name in names)
+            results.setdefault(key, []).append(stats)
+            if (i + 1) % 100 == 0:
+                print("%d/%d games, %.0fs" % (i + 1, len(jobs_list),
+                                              time.perf_counter() - started))
+
+    fields = names + ["games", "score", "score_min", "score_max", "deaths",
+                      "survival_seconds", "ms_per_frame", "ms_per_frame_max"]
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fields)
+        writer.writeheader()
+        for key, runs in results.items():
+            lives = [life for stats in runs for life in stats["lives"]]
+            costs = [1000.0 * stats["seconds"] / max(stats["frames"], 1)
+                     for stats in runs]
+            row = dict(zip(names, key))
+            row.update(
+                games=len(runs),
+                score=sum(stats["score"] for stats in runs) / len(runs),
+                score_min=min(stats["score"] for stats in runs),
+                score_max=max(stats["score"] for stats in runs),
+                deaths=sum(stats["deaths"] for stats in runs) / len(runs),
+                # every life counts, the ones still going at the end too,
+                # or games nobody died in would be left out
+                survival_seconds=sum(lives) / float(len(lives)) / TICK_RATE,
+                ms_per_frame=sum(costs) / len(costs),
+                ms_per_frame_max=max(costs),
+            )
+            writer.writerow(row)
+    print("%d games in %.1fs, written to %s" % (
+        len(jobs_list), time.perf_counter() - started, path))
+
+
+def bench_collisions(counts=(100, 300, 1000, 3000), frames=10, seed=0):
+    """Times SpatialHash.collide against the brute force collision passes.
+
+    'count' enemies, shots and bombs of the game's sizes are scattered over
+    an area that grows with 'count', so the sprite density stays the same
+    as on a busy screen, and jittered every frame. Prints milliseconds per
+    frame for both methods, and for the grid with collide_mask as its
+    narrowphase, and checks that they find the same hits.
+    """
+    rng = random.Random(seed)
+    images = {}
+    print("%8s %12s %12s %12s" % ("sprites", "brute ms", "grid ms", "mask ms"))
+    for count in counts:
+        scale = max(1.0, (count / 100.0) ** 0.5)
+        world = pg.Rect(0, 0, SCREENRECT.width * scale, SCREENRECT.height * scale)
+
+        def scatter(group, size):
+            if size not in images:
+                images[size] = pg.Surface(size, pg.SRCALPHA)
+                pg.draw.ellipse(images[size], "white", images[size].get_rect())
+            sprite = pg.sprite.Sprite(group)
+            sprite.image = images[size]
+            sprite.rect = pg.Rect((0, 0), size)
+            sprite.rect.center = rng.randrange(world.width), rng.randrange(world.height)
+
+        enemygroups = (pg.sprite.Group(), pg.sprite.Group(), pg.sprite.Group())
+        shots = pg.sprite.Group()
+        bombs = pg.sprite.Group()
+        for i in range(count):
+            scatter(enemygroups[i % 3], (80, 71))
+            scatter(shots, (9, 18))
+            scatter(bombs, (16, 24))
+        player = pg.sprite.Sprite()
+        scatter(pg.sprite.Group(), (90, 61))
+        player.image = images[90, 61]
+        player.rect = pg.Rect(0, 0, 90, 61)
+        player.rect.midbottom = world.midbottom
+        sprites = [s for g in enemygroups + (shots, bombs) for s in g]
+
+        grid = SpatialHash()
+        maskgrid = SpatialHash(collided=collide_mask)
+        brute = fast = masked = 0.0
+        for frame in range(frames):
+            for sprite in sprites:
+                sprite.rect.move_ip(rng.randrange(-9, 10), rng.randrange(-9, 10))
+
+            started = time.perf_counter()
+            crashed = [
+                e for g in enemygroups for e in pg.sprite.spritecollide(player, g, 0)
+            ]
+            shot = [
+                e for g in enemygroups for e in pg.sprite.groupcollide(g, shots, 0, 0)
+            ]
+            bombed = pg.sprite.spritecollide(player, bombs, 0)
+            brute = brute + time.perf_counter() - started
+
+            started = time.perf_counter()
+            grid.sync(*enemygroups + (shots, bombs))
+            hits = grid.collide(player, enemygroups, shots, bombs, dokill=False)
+            fast = fast + time.perf_counter() - started
+
+            started = time.perf_counter()
+            maskgrid.sync(*enemygroups + (shots, bombs))
+            maskhits = maskgrid.collide(player, enemygroups, shots, bombs, dokill=False)
+            masked = masked + time.perf_counter() - started
+
+            assert set(crashed) == set(e for g, e in hits[0])
+            assert set(shot) == set(e for g, e in hits[1])
+            assert set(bombed) == set(hits[2])
+            assert set(e for g, e in maskhits[1]) <= set(shot)
+        print("%8d %12.3f %12.3f %12.3f" % (
+            count * 3, 1000.0 * brute / frames, 1000.0 * fast / frames,
+            1000.0 * masked / frames))
+
+
+def bench_movers(counts=(1000, 3000, 10000, 30000), frames=20):
+    """Times MoverEngine.step against calling update() on every alien.
+
+    Both get the same aliens scattered over the screen, and must leave
+    every alien with the same rect and image.
+    """
+    images = [pg.Surface((80, 71)) for i in range(3)]
+    print("%8s %12s %12s" % ("aliens", "update ms", "numpy ms"))
+    loaded = Alien.images
+    Alien.images = images
+    try:
+        for count in counts:
+            results = []
+            for numpy_movers in (False, True):
+                game = Game(seed=count)
+                group = game.enemies
+                for i in range(count):
+                    alien = Alien(game)
+                    alien.rect.y = game.rng.randrange(SCREENRECT.height - alien.rect.height)
+                if numpy_movers:
+                    game.engine = MoverEngine({Alien: group})
+                    for alien in group:
+                        game.engine.add(alien, vx=alien.facing, bounce=True,
+                                        cycle=alien.animcycle, frames=3)
+                started = time.perf_counter()
+                for frame in range(frames):
+                    if game.engine:
+                        game.engine.step()
+                    else:
+                        group.update()
+                seconds = time.perf_counter() - started
+                results.append(
+                    (seconds, [(tuple(a.rect), images.index(a.image)) for a in group])
+                )
+            assert results[0][1] == results[1][1]
+            print("%8d %12.3f %12.3f" % (
+                count, 1000.0 * results[0][0] / frames, 1000.0 * results[1][0] / frames))
+    finally:
+        # leave the loaded images for the games played after
+        Alien.images = loaded
+
+
+# The images of the menus, and of the game once it starts, as (file, size)
+MENU_IMAGES = [
+    ("background3.gif", (640, 480)),
+    ("button_resume.png", None),
+    ("button_options.png", None),
+    ("button_quit.png", None),
+]
+OPTIONS_IMAGES = [
+    ("button_back.png", None),
+    ("plane4.png", (100, 100)),
+    ("plane.png", (100, 100)),
+    ("alienny2.png", None),
+]
+SOUNDS = [file for file, priority, voices in EFFECTS.values()]
+
+
+def animated():
+    """the classes whose 'frames' the game loads"""
+    return ((Player, Explosion) + tuple(ENEMIES.values())
+            + (Bomb, Shot, ScrollingBackground))
+
+
+def game_images():
+    return list(collections.OrderedDict.fromkeys(
+        (frame.file, frame.size) for cls in animated() for frame in cls.frames
+    ))
+
+
+def load_sprite_images():
+    """Loads every class's 'frames' into its 'images'.
+
+    The AssetLoader has usually decoded them all while the menu was up.
+    Frames are scaled, flipped, rotated and tinted once here, and never
+    while playing.
+    """
+    for cls in animated():
+        cls.images = [load_frame(frame) for frame in cls.frames]
+    if PIXEL_PERFECT:
+        # make the collision masks now, for every frame including the flips
+        for cls in animated()[:-1]:
+            for image in cls.images:
+                get_mask(image)
+
+
+class Game:
+    """One game: its sprites and groups, random numbers, state and events.
+
+    Everything that changes as a game plays is kept here rather than in
+    module globals or class attributes, so any number of games can be
+    stepped side by side in one process. The sprite classes only keep
+    what every game shares, their own speeds, which each game scales by
+    its Settings, and their loaded images, and each
+    sprite is made for a game: Player(game), ENEMIES[key](game),
+    Shot.spawn(game, pos). Their class 'containers' name the groups of
+    the game they go in. Only the sprites in 'updated' have update()
+    called each tick, the ones a MoverEngine moves are left out of it.
+
+    start() makes the player and the first enemy, once the images are
+    loaded. step() then plays one tick with the keys held down, and
+    respawn() brings the player back after dying. Drawing and timing the
+    ticks are left to the caller. 'effects' is the SoundBoard to play the
+    game's sounds on, or None for silence, and 'timer' a PhaseTimer the
+    phases of each tick are timed on. 'settings' are the Settings it plays
+    with, game_constants() if None.
+    """
+
+    def __init__(self, seed=None, enemy="alien", effects=None, timer=None,
+                 numpy_movers=False, settings=None):
+        if seed is None:
+            seed = random.randrange(1 << 32)
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.enemy = enemy
+        self.effects = effects
+        self.lap = timer.lap if timer else lambda phase: None
+        self.settings = game_constants() if settings is None else settings
+        self.state = GameState(reload=self.settings.alien_reload)
+        # the speed of every class the settings scale, in this game
+        self.speeds = dict(
+            (cls, cls.speed * self.settings.enemy_speed // 100) for cls in ENEMIES.values()
+        )
+        self.speeds[Bomb] = Bomb.speed * self.settings.bomb_speed // 100
+
+        self.enemies = pg.sprite.Group()
+        self.shots = pg.sprite.Group()
+        self.bombs = pg.sprite.Group()
+        self.all = BatchedUpdates()
+        self.updated = pg.sprite.Group()
+        self.containers = {}  # sprite class: the groups it goes in
+        self.peaks = collections.OrderedDict(
+            (name, 0) for name in ("all", "enemies", "shots", "bombs")
+        )
+
+        # recycle killed shots, bombs and explosions instead of making new ones
+        self.pools = dict(
+            (cls, SpritePool(cls, self, POOL_SIZE)) for cls in (Shot, Bomb, Explosion)
+        )
+        # optionally move the enemies and bombs with numpy, a group at a time
+        self.engine = None
+        if numpy_movers and np is not None:
+            movers = dict((cls, self.enemies) for cls in ENEMIES.values())
+            movers[Bomb] = self.bombs
+            self.engine = MoverEngine(movers)
+        self.grid = SpatialHash(
+            collided=collide_mask if self.settings.pixel_perfect else None
+        )
+
+        # what the events of a tick do, handled together once it is over
+        self.events = EventBus()
+        self.events.subscribe(ShotFired, self.fired)
+        self.events.subscribe(Hit, self.hit)
+        self.events.subscribe(PlayerDeath, self.died)
+        self.events.subscribe(BombLanded, self.landed)
+
+        self.player = None
+        self.latest = None  # only the newest enemy drops bombs
+        self.lives = []  # ticks each player lived, but the current one
+
+    def groups(self, sprite):
+        """this game's groups named by the 'containers' of 'sprite'"""
+        cls = type(sprite)
+        groups = self.containers.get(cls)
+        if groups is None:
+            names = cls.containers
+            if self.engine and cls in self.engine.classes:
+                # the engine moves it, update() has nothing left to do
+                names = [name for name in names if name != "updated"]
+            groups = self.containers[cls] = [getattr(self, name) for name in names]
+        return groups
+
+    def start(self):
+        self.player = Player(self)
+        if self.enemy:
+            self.latest = ENEMIES[self.enemy](self)
+
+    def respawn(self):
+        state = self.state
+        state.deaths += 1
+        self.lives.append(state.tick - state.born)
+        state.born = state.tick
+        self.player = Player(self)
+
+    def step(self, keystate):
+        """plays one tick, 'keystate' is what pg.key.get_pressed() returns"""
+        state, player, lap = self.state, self.player, self.lap
+        settings = self.settings
+        state.tick += 1
 
+        # update all the sprites
+        self.updated.update()
+        if self.engine:
+            self.engine.step()
+        lap("update")
 
+        # handle player input
+        direction = keystate[pg.K_RIGHT] - keystate[pg.K_LEFT]
+        player.move(direction)
+        firing = keystate[pg.K_SPACE]
+        if not player.reloading and firing and len(self.shots) < settings.max_shots:
+            # spawned now, so the shot can hit something this tick
+            Shot.spawn(self, player.gunpos())
+            self.events.push(ShotFired(player.gunpos()))
+        player.reloading = firing
+        lap("input")
+
+        # Create new alien
+        if state.reload:
+            state.reload -= 1
+        elif not int(self.rng.random() * settings.alien_odds):
+            if self.enemy:
+                if self.rng.randint(0, 1) == 0:
+                    self.latest = ENEMIES[self.enemy](self)
+                state.reload = settings.alien_reload
+
+        # Drop bombs
+        latest = self.latest
+        if latest and latest.alive() and latest.drops_bomb():
+            Bomb.spawn(self, latest)
+
+        lap("spawn")
+
+        # Find every collision of the tick in one pass over the grid.
+        self.grid.sync(self.enemies, self.shots, self.bombs)
+        lap("grid")
+        crashed, shot, bombed = self.grid.collide(
+            player, (self.enemies,), self.shots, self.bombs
+        )
+        lap("collide")
+
+        # Detect collisions between enemies and players.
+        for group, enemy in crashed:
+            self.events.push(Hit(enemy, "player"))
+            self.events.push(PlayerDeath(player, enemy))
 
-def main(winstyle=0):
+        # See if shots hit the enemies.
+        for group, enemy in shot:
+            self.events.push(Hit(enemy, "shot"))
+
+        # See if alien boms hit the player.
+        for bomb in bombed:
+            self.events.push(PlayerDeath(player, bomb))
+
+        # play the sounds, explode and score what happened this tick
+        self.events.drain()
+
+        peaks = self.peaks
+        for name, group in zip(peaks, (self.all, self.enemies, self.shots, self.bombs)):
+            peaks[name] = max(peaks[name], len(group))
+        lap("hits")
+
+    def sound(self, name):
+        if self.effects:
+            self.effects.play(name)
+
+    def fired(self, shotsfired):
+        self.sound("shoot")
+
+    def hit(self, hits):
+        for sound in set(event.enemy.sound for event in hits):
+            self.sound(sound)
+        for event in hits:
+            Explosion.spawn(self, event.enemy)
+        self.state.score += sum(event.enemy.score for event in hits)
+
+    def died(self, losses):
+        for event in losses:
+            if isinstance(event.cause, Bomb):
+                self.sound("boom")
+                Explosion.spawn(self, event.player)
+                Explosion.spawn(self, event.cause)
+            else:
+                Explosion.spawn(self, event.player)
+            event.player.kill()
+
+    def landed(self, landings):
+        for event in landings:
+            Explosion.spawn(self, event)
+
+    def stats(self):
+        """the game's score, counts and ending, for the headless statistics"""
+        return {
+            "frames": self.state.tick,
+            "peaks": self.peaks,
+            "score": self.state.score,
+            "deaths": self.state.deaths,
+            # and the life still going when the game stopped
+            "lives": self.lives + [self.state.tick - self.state.born],
+            "seed": self.seed,
+            "digest": state_digest(self.all),
+            "events": dict(self.events.counts),
+            "pools": dict(
+                (cls.__name__, pool.stats()) for cls, pool in self.pools.items()
+            ),
+        }
+
+
+def simulate(games=100, frames=2000, enemy="alien", bot=False, seed=0,
+             settings=None):
+    """Steps 'games' headless games side by side in one process.
+
+    Game i is seeded with seed + i and plays 'frames' ticks, each with its
+    own ScriptedInput, or BotInput with bot=True, respawning as in main().
+    They all play with 'settings', game_constants() if None. Prints the
+    memory each game took to make and start, the ticks per second of all
+    of them together and their mean score, and returns
+    every game's Game.stats().
+    """
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    pg.display.init()
+    pg.display.set_mode(SCREENRECT.size)
+    load_sprite_images()
+
+    tracemalloc.start()
+    sessions = []
+    for i in range(games):
+        game = Game(seed + i, enemy, numpy_movers=NUMPY_MOVERS, settings=settings)
+        game.start()
+        if bot:
+            controls = BotInput(lambda game=game: game.player, (game.enemies,), game.bombs)
+        else:
+            controls = ScriptedInput(seed + i)
+        sessions.append((game, controls))
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    for tick in range(frames):
+        for game, controls in sessions:
+            if not game.player.alive():
+                game.respawn()
+            game.step(controls.get_pressed())
+    seconds = time.perf_counter() - started
+    stats = [game.stats() for game, controls in sessions]
+    print("%d games of %d ticks in %.1fs, %.0f ticks/s, %.1f KB per game, mean score %.1f"
+          % (games, frames, seconds, games * frames / seconds, size / 1024.0 / games,
+             sum(s["score"] for s in stats) / float(games)))
+    return stats
+
+
+class Telemetry:
+    """Sends lines of JSON to a TCP server, from a task of its own.
+
+    send() only queues a line, so a slow or dead connection never holds
+    up a tick; a line that doesn't fit in the queue is dropped. start()
+    connects once the event loop runs, close() sends what is left.
+    """
+
+    def __init__(self, host, port, maxsize=1000):
+        self.host = host
+        self.port = port
+        self.queue = asyncio.Queue(maxsize)
+        self.task = None
+        self.sent = self.dropped = 0
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    def send(self, **fields):
+        try:
+            self.queue.put_nowait(json.dumps(fields) + "\n")
+        except asyncio.QueueFull:
+            self.dropped = self.dropped + 1
+
+    async def run(self):
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+        except OSError as e:
+            print("Warning, no telemetry: %s" % e)
+            return
+        try:
+            while True:
+                line = await self.queue.get()
+                if line is None:
+                    break
+                writer.write(line.encode())
+                self.sent = self.sent + 1
+                if self.queue.empty():
+                    await writer.drain()
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+    async def close(self):
+        if not self.task.done():
+            await self.queue.put(None)
+        await self.task
+        self.dropped = self.dropped + self.queue.qsize()
+
+    def stats(self):
+        return {"sent": self.sent, "dropped": self.dropped}
+
+
+class StandInServer:
+    """A TCP server on the loopback interface, standing in for a real one.
+
+    Keeps every JSON line it is sent in 'received', so Telemetry and the
+    AsyncRunner can be tried without a network. start() picks a free port.
+    """
+
+    def __init__(self):
+        self.received = []
+        self.clients = set()
+        self.server = None
+        self.port = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def handle(self, reader, writer):
+        self.clients.add(asyncio.current_task())
+        async for line in reader:
+            self.received.append(json.loads(line))
+        writer.close()
+
+    async def close(self):
+        """stops listening once every client has hung up"""
+        await asyncio.gather(*self.clients)
+        self.server.close()
+        await self.server.wait_closed()
+
+
+class AsyncRunner:
+    """Runs a game loop on an asyncio event loop, in real time.
+
+    The ticks and the drawing are two tasks, each sleeping until its next
+    deadline instead of blocking in clock.tick(), so whatever else shares
+    the loop, like Telemetry writing to its socket or a recording being
+    saved, runs in between them. asyncio.sleep() can wake a millisecond
+    or more late, so the last 'spin' seconds before a deadline are spent
+    yielding to the loop instead. 'late' keeps how late each tick was.
+
+    'tick' is called with no arguments TICK_RATE times a second to play
+    one tick, and the loop stops once it returns False. 'draw' is called
+    on a timer of its own, FRAME_RATE times a second or TICK_RATE times
+    when FRAME_RATE is 0, starting half a tick after the first one, with
+    how far the game has got from the last tick to the next, from 0 to 1.
+    'lap' is called with "wait" after every sleep, as a PhaseTimer's is.
+    """
+
+    spin = 0.002
+
+    def __init__(self, tick, draw=None, lap=None):
+        self.tick = tick
+        self.draw = draw
+        self.lap = lap or (lambda phase: None)
+        self.late = []
+        self.ticked = 0.0  # when the last tick was due
+        self.running = False
+
+    async def sleep_until(self, deadline):
+        loop = asyncio.get_running_loop()
+        wait = deadline - loop.time() - self.spin
+        if wait > 0:
+            await asyncio.sleep(wait)
+        while loop.time() < deadline:
+            await asyncio.sleep(0)
+        self.lap("wait")
+
+    async def ticks(self):
+        loop = asyncio.get_running_loop()
+        period = 1.0 / TICK_RATE
+        deadline = loop.time()
+        while True:
+            await self.sleep_until(deadline)
+            now = loop.time()
+            self.late.append(now - deadline)
+            if now - deadline > MAX_FRAMESKIP * period:
+                deadline = now  # too far behind, slow the game down
+            self.ticked = deadline
+            if not self.tick():
+                break
+            deadline = deadline + period
+        self.running = False
+
+    async def frames(self):
+        loop = asyncio.get_running_loop()
+        period = 1.0 / (FRAME_RATE or TICK_RATE)
+        # half way between ticks, so drawing doesn't hold the next one up
+        deadline = loop.time() + 0.5 / TICK_RATE
+        while self.running:
+            await self.sleep_until(deadline)
+            if not self.running:
+                break
+            self.draw(min(1.0, (loop.time() - self.ticked) * TICK_RATE))
+            deadline = max(deadline + period, loop.time())
+
+    async def run(self):
+        self.running = True
+        drawing = None
+        if self.draw:
+            drawing = asyncio.get_running_loop().create_task(self.frames())
+        await self.ticks()
+        if drawing:
+            await drawing
+
+    def stats(self):
+        """milliseconds late at p50/p95/p99 and at worst"""
+        ordered = sorted(self.late) or [0.0]
+        return [
+            1000.0 * ordered[min(len(ordered) - 1, len(ordered) * point // 100)]
+            for point in (50, 95, 99)
+        ] + [1000.0 * ordered[-1]]
+
+
+def play_async(frames=400, seed=None, enemy="alien", bot=False, telemetry=None,
+               record=None):
+    """Plays one headless game on asyncio in real time, sending telemetry.
+
+    main() plays it with realtime=True, on the same AsyncRunner, drawing
+    and sounds as a game in a window. Every hit and death, and the final
+    score for a leaderboard, is sent as a JSON line to 'telemetry', a
+    (host, port) pair, or to a StandInServer on the loopback interface
+    without one. A recording is saved to 'record' on a thread while the
+    telemetry is still being sent. Prints and returns main()'s statistics,
+    which include how late the ticks were and what was sent.
+    """
+    stats = main(headless=True, realtime=True, frames=frames, seed=seed, enemy=enemy,
+                 bot=bot, record=record, telemetry=telemetry or True)
+    sent, received = stats["telemetry"], stats["received"]
+    print("%d ticks at %d a second, late by p50/p95/p99 %.3f/%.3f/%.3f ms, at worst %.3f ms"
+          % ((stats["frames"], TICK_RATE) + tuple(stats["late"])))
+    print("score %d, deaths %d, %d telemetry lines sent, %d dropped%s" % (
+        stats["score"], stats["deaths"], sent["sent"], sent["dropped"],
+        "" if received is None else ", %d received by the stand-in" % len(received)))
+    return stats
+
+
+def check_async(frames=200, seed=0):
+    """Plays play_async() against a StandInServer and checks the runner.
+
+    Every telemetry line must arrive, the last one with the final score,
+    the game must end as the same game played uncapped does, and no more
+    than one tick in twenty may be late by more than a quarter of a tick.
+    Returns True if it all holds.
+    """
+    expected = main(headless=True, frames=frames, seed=seed)
+    stats = play_async(frames=frames, seed=seed)
+    sent, received = stats["telemetry"], stats["received"]
+    score = {"event": "score", "seed": seed, "score": stats["score"],
+             "deaths": stats["deaths"]}
+    problems = []
+    if sent["dropped"] or len(received) != sent["sent"]:
+        problems.append("%d telemetry lines sent, %d dropped, %d received"
+                        % (sent["sent"], sent["dropped"], len(received)))
+    if not received or received[-1] != score:
+        problems.append("the last line received wasn't the score")
+    if (stats["score"], stats["digest"]) != (expected["score"], expected["digest"]):
+        problems.append("ended unlike the uncapped game, score %d against %d"
+                        % (stats["score"], expected["score"]))
+    if stats["late"][1] > 250.0 / TICK_RATE:
+        problems.append("p95 of ticks late by %.3f ms" % stats["late"][1])
+    print("; ".join(problems) or "telemetry and timing ok")
+    return not problems
+
+
+def main(winstyle=0, headless=False, frames=0, seed=None, enemy="alien",
+         controls=None, record=None, bot=False, profile=False, trace=None,
+         settings=None, realtime=False, telemetry=None):
+    """Runs the game.
+
+    The game itself is a Game, main() adds the window, the menus, drawing
+    and keeping time.
+
+    With headless=True the menu is skipped, 'enemy' (a key of ENEMIES,
+    or None for no enemies) is picked as if chosen in the options menu,
+    and 'frames' frames are run uncapped with scripted input under the
+    SDL dummy drivers. The player respawns when killed, and a dict of timing
+    statistics is returned. With bot=True a BotInput plays instead of the
+    scripted input. With realtime=True too the frames are played in real
+    time on an AsyncRunner, as a game in a window is, and the statistics
+    include how late the ticks were.
+
+    With 'telemetry' set to a (host, port) pair every hit and death, and
+    the final score, is sent there as a JSON line. True sends them to a
+    StandInServer on the loopback interface, and what it received is
+    kept in the statistics.
+
+    With profile=True the time each phase of the main loop takes is shown
+    on screen, F3 toggles it. With 'trace' set to a file name every phase
+    of every frame is written there as Chrome trace events as it plays.
+
+    'seed' seeds the game's random numbers, a random one is used if None,
+    and the game plays with 'settings', game_constants() if None.
+    'controls' is read instead of the keyboard if given, anything with a
+    get_pressed() method will do. With 'record' set to a file name the
+    game is saved there as a GameLog when it ends.
+    """
+    if headless:
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
+        os.environ["SDL_AUDIODRIVER"] = "dummy"
+    if seed is None:
+        seed = random.randrange(1 << 32)
     # Initialize pygame
     menu_state = "main"
     if pg.get_sdl_version()[0] == 2:
-        pg.mixer.pre_init(44100, 32, 2, 1024)
+        pg.mixer.pre_init(*MIXER_FORMAT)
     pg.init()
     if pg.mixer and not pg.mixer.get_init():
         print("Warning, no sound")
@@ -369,108 +2794,135 @@ def main(winstyle=0):
     bestdepth = pg.display.mode_ok(SCREENRECT.size, winstyle, 32)
     screen = pg.display.set_mode(SCREENRECT.size, winstyle, bestdepth)
 
-    # Load images, assign to sprite classes
-    # (do this before the classes are used, after screen setup)
-    img = load_image("player1.gif")
-    Player.images = [img, pg.transform.flip(img, 1, 0)]
-    img = load_image("explosion1.gif")
-    Explosion.images = [img, pg.transform.flip(img, 1, 1)]
-    Alien.images = [load_image(im) for im in ("alien1.gif", "alien2.gif", "alien3.gif")]
-    Balloon.images = [load_image("plane.png")]
-    OtherAlien.images = [load_image(im) for im in ("alienny2.png", "alienny2.png", "alienny2.png")]
-    Bomb.images = [load_image("bomb.gif")]
-    Shot.images = [load_image("shot.gif")]
-    Plane.images = [load_image(i) for i in ("plane4.png", "plane4.png")]
-    # StartKnapp.images = [load_image("Menu_Green_01.png"), load_image("Menu_Red_03.png")]
-    # Quit.images = [load_image("Menu_Green_04.png")]
-    BackgroundKlass.images = [load_image("background4.png")]
-
+    # Queue every image and sound on the loader's threads, the menu's first.
+    # The menu only waits for its own images, the options menu and the
+    # game's are decoded while it is up.
+    for file, size in MENU_IMAGES + OPTIONS_IMAGES + game_images():
+        loader.image(file, size)
+    for file in SOUNDS:
+        loader.sound(file)
 
     #load button images
-    resume_img = load_image("button_resume.png").convert_alpha()
-    options_img = load_image("button_options.png").convert_alpha()
-    quit_img = load_image("button_quit.png").convert_alpha()
-    back_img = load_image("button_back.png").convert_alpha()
-    plane_img = load_image("plane4.png").convert_alpha()
-    plane_img = pg.transform.scale(plane_img, (100,100))
-    baloon_img = load_image("plane.png").convert_alpha()
-    baloon_img = pg.transform.scale(baloon_img, (100,100))
-    otheralien_img = load_image("alienny2.png").convert_alpha()
+    resume_img = load_image("button_resume.png")
+    options_img = load_image("button_options.png")
+    quit_img = load_image("button_quit.png")
     
 
     #create button instances
     resume_button = Button(240, 100, resume_img, 1)
     options_button = Button(240, 200, options_img, 1)
     quit_button = Button(240, 300, quit_img, 1)
-    back_button = Button(240, 370, back_img, 1)
-    plane_button = Button(50, 50, plane_img, 1)
-    baloon_button = Button(50, 200, baloon_img, 1)
-    otheralien_button = Button(50, 350,otheralien_img,1)
+    # the options menu's buttons are made the first time it is opened
+    back_button = plane_button = baloon_button = otheralien_button = None
 
 
     
     
     # decorate the game window
-    icon = pg.transform.scale(Alien.images[0], (32, 32))
-    pg.display.set_icon(icon)
     pg.display.set_caption("Pygame Aliens")
     pg.mouse.set_visible(True)
 
     # create the background, tile the bgd image
-    bgdtile = pg.transform.scale(load_image("background3.gif"),(640,480))
+    bgdtile = load_image("background3.gif", size=(640, 480))
     background = pg.Surface(SCREENRECT.size)
     for x in range(0, SCREENRECT.width, bgdtile.get_width()):
         background.blit(bgdtile, (x, 0))
     screen.blit(background, (0, 0))
     pg.display.flip()
 
-    # load the sound effects
-    boom_sound = load_sound("boom.wav")
-    shoot_sound = load_sound("car_door.wav")
-    punch_sound = load_sound("punch.wav")
     if pg.mixer:
         music = os.path.join(main_dir, "data", "house_lo.wav")
         pg.mixer.music.load(music)
         pg.mixer.music.play(-1)
 
-    # Initialize Game Groups
-    aliens = pg.sprite.Group()
-    balloons = pg.sprite.Group()
-    shots = pg.sprite.Group()
-    bombs = pg.sprite.Group()
-    all = pg.sprite.RenderUpdates()
-    lastalien = pg.sprite.GroupSingle()
-    lastballoon = pg.sprite.GroupSingle()
-    planes = pg.sprite.Group()
-    last_palne = pg.sprite.GroupSingle()
-    menu = pg.sprite.Group()
-    
-
-
-    # assign default groups to each sprite class
-    Player.containers = all
-    Alien.containers = aliens, all, lastalien
-    Balloon.containers = balloons, all, lastballoon
-    OtherAlien.containers = aliens, all
-    Plane.containers = planes, all, last_palne
-    Shot.containers = shots, all
-    Bomb.containers = bombs, all
-    Explosion.containers = all
-    Score.containers = all
-    # StartKnapp.containers = menu
-    # Quit.containers = menu
-    BackgroundKlass.containers = all
+    if NUMPY_MOVERS and np is None:
+        print("Warning, no numpy, moving sprites one at a time")
 
     # Create Some Starting Values
     global score
-    alienreload = ALIEN_RELOAD
     clock = pg.time.Clock()
 
+    chosen = None  # the ENEMIES key of the kind picked in the options menu
+    menu_state = False
+    start_game = False
+    if headless:
+        # skip the menu as if 'enemy' was picked in the options menu
+        chosen = enemy
+        start_game = True
+    menus = {
+        False: (resume_button, options_button, quit_button),  # main menu
+    }
+    menu_clock = pg.time.Clock()
+    redraw = True
+    # The menu sleeps in pg.event.wait() until there is some input, and then
+    # only redraws the buttons that changed, at most MENU_FRAME_RATE times
+    # a second.
+    while not start_game:
+        buttons = menus[menu_state]
+        if redraw:
+            pos = pg.mouse.get_pos()
+            screen.blit(background, (0, 0))
+            for button in buttons:
+                # the mouse up of a click that opened another menu went
+                # to that menu's buttons, not this one's
+                button.reset(pos)
+                button.draw(screen)
+            pg.display.flip()
+            redraw = False
+
+        clicked = None
+        for event in [pg.event.wait(MENU_TIMEOUT)] + pg.event.get():
+            if event.type == pg.QUIT:
+                return
+            for button in buttons:
+                if button.handle(event):
+                    clicked = button
+
+        if clicked is None:
+            pg.display.update(
+                [button.draw(screen, background) for button in buttons if button.changed]
+            )
+        elif clicked is resume_button:
+            start_game = True
+        elif clicked is options_button:
+            if True not in menus:
+                back_button = Button(240, 370, load_image("button_back.png"), 1)
+                plane_button = Button(50, 50, load_image("plane4.png", size=(100, 100)), 1)
+                baloon_button = Button(50, 200, load_image("plane.png", size=(100, 100)), 1)
+                otheralien_button = Button(50, 350, load_image("alienny2.png"), 1)
+                menus[True] = (plane_button, baloon_button, otheralien_button, back_button)
+            menu_state = True
+            redraw = True
+        elif clicked is quit_button:
+            return
+        elif clicked is plane_button:
+            chosen = "plane"
+            start_game = True
+        elif clicked is baloon_button:
+            chosen = "balloon"
+            start_game = True
+        elif clicked is otheralien_button:
+            chosen = "alien"
+            start_game = True
+        elif clicked is back_button:
+            menu_state = False
+            redraw = True
+        menu_clock.tick(MENU_FRAME_RATE)
+    pg.mouse.set_visible(False)    
+
+    # the game's images and sounds, waiting for any still being loaded
+    load_sprite_images()
+    icon = pg.transform.scale(Alien.images[0], (32, 32))
+    pg.display.set_icon(icon)
+    effects = SoundBoard()
+    timer = PhaseTimer(trace=trace)
+    game = Game(seed, chosen, effects, timer, NUMPY_MOVERS, settings)
+    all = game.all
+
     # initialize our starting sprites
-    global SCORE
     # start_knapp = StartKnapp()
-    BackgroundKlass()
-    player = Player()
+    scroller = ScrollingBackground(SCROLL_SPEED)
+    game.start()
     
     
     # Alien()  # note, this 'lives' because it goes into a sprite group
@@ -480,93 +2932,44 @@ def main(winstyle=0):
     # Plane()
     
     if pg.font:
-        all.add(Score())
-    plane1 = False
-    alien1 = False
-    baloon1 = False
-    menu_state = False
-    start_game = False
-    while not start_game:
-        screen.blit(background, (0, 0))
-        if menu_state == False:  # When it is in the main menu
-            if resume_button.draw(screen):
-                start_game= True
-                pg.display.flip()
-                dirty = menu.draw(screen)
-                pg.display.update(dirty)
-                pg.mouse.set_visible(False)
-                # game_paused = False
-            if options_button.draw(screen):
-                menu_state = True
-            if quit_button.draw(screen):
-                pg.quit()
-        elif menu_state == True: # when it will be in the option menu
-                       
-            if plane_button.draw(screen):
-                
-
-                Plane()
-                plane1 = True
-                start_game= True
-                   
-                
-
-            if baloon_button.draw(screen):
-                Balloon()
-                baloon1 = True
-                start_game= True
-                
-            if otheralien_button.draw(screen):
-                Alien()
-                alien1 = True
-                start_game= True
-
-            if back_button.draw(screen):
-                menu_state = False
-                
-        for event in pg.event.get():
-            if event.type == pg.KEYDOWN:
-                pass
-            if event.type == pg.QUIT:
-                return
-
-
-
-
-        # for event in pg.event.get():
-        #     if event.type == pg.KEYDOWN:
-        #         start_game = True
-        #     elif event.type == pg.MOUSEBUTTONDOWN:
-        #         if(Quit().rect.collidepoint(pg.mouse.get_pos())):
-        #             pg.quit()
-                    
-        #     elif event.type == pg.MOUSEBUTTONDOWN:
-        #         if(start_knapp.rect.collidepoint(pg.mouse.get_pos())):
-        #             start_knapp.nedtryckt()
-                    
-        #     elif event.type == pg.MOUSEBUTTONUP:
-        #             if(start_knapp.rect.collidepoint(pg.mouse.get_pos())):
-        #                 start_knapp.upptryckt()
-        #                 start_game = True
-                    
-                    
-                
-
-
-        pg.display.flip()
-        dirty = menu.draw(screen)
-        pg.display.update(dirty)
-    pg.mouse.set_visible(False)    
-
-    # Run our main loop whilst the player is alive.
-    while player.alive():
-
-        # get input
+        all.add(Score(game.state))
+
+    # paint over the menu; a still background is drawn once and then
+    # only the sprites' dirty rects get erased and updated
+    if not scroller.speed:
+        scroller.draw(background)
+    scroller.draw(screen)
+    regions = DirtyRegions()
+    regions.flip()
+
+    if headless and controls is None:
+        if bot:
+            controls = BotInput(lambda: game.player, (game.enemies,), game.bombs)
+        else:
+            controls = ScriptedInput(seed)
+    log = None
+    if record:
+        log = GameLog(seed, chosen, game.settings)
+    overlay = None
+    if pg.font:
+        overlay = ProfileOverlay(timer)
+        if profile:
+            overlay.add(all, game.updated)
+    # headless runs go as fast as they can, unless played in real time
+    uncapped = headless and not realtime
+    interpolator = Interpolator()
+    renders = 0
+    quitting = False
+    started = time.perf_counter()
+
+    def poll():
+        """handles the window's events, False once quitting"""
+        nonlocal screen, fullscreen, quitting
         for event in pg.event.get():
             if event.type == pg.QUIT:
-                return
+                quitting = True
             if event.type == pg.KEYDOWN and event.key == pg.K_ESCAPE:
-                return
+                quitting = True
             elif event.type == pg.KEYDOWN:
                 if event.key == pg.K_f:
                     if not fullscreen:
@@ -583,120 +2986,151 @@ def main(winstyle=0):
                             SCREENRECT.size, winstyle, bestdepth
                         )
                         screen.blit(screen_backup, (0, 0))
-                    pg.display.flip()
+                    regions.flip()
                     fullscreen = not fullscreen
+                elif event.key == pg.K_F3 and overlay:
+                    if overlay.alive():
+                        overlay.kill()
+                    else:
+                        overlay.add(all, game.updated)
+        timer.lap("event")
+        return not quitting
 
-        keystate = pg.key.get_pressed()
-
-        # clear/erase the last drawn sprites
-        all.clear(screen, background)
-
-        # update all the sprites
-        all.update()
-
-        # handle player input
-        direction = keystate[pg.K_RIGHT] - keystate[pg.K_LEFT]
-        player.move(direction)
-        firing = keystate[pg.K_SPACE]
-        if not player.reloading and firing and len(shots) < MAX_SHOTS:
-            Shot(player.gunpos())
-            if pg.mixer:
-                shoot_sound.play()
-        player.reloading = firing
-
-        # Create new alien
-        if alienreload:
-            alienreload = alienreload - 1
-        elif not int(random.random() * ALIEN_ODDS):
-            if plane1 == True:
-
-                if(random.randint(0, 1) == 0):
-                    # Alien()
-                    Plane()
-                # else:
-                #     OtherAlien()
-                #     Balloon()
-                alienreload = ALIEN_RELOAD
-            elif baloon1 == True :
-
-                if(random.randint(0, 1) == 0):
-                   Balloon()
-               
-                alienreload = ALIEN_RELOAD
-            elif alien1 == True:
-
-                if(random.randint(0, 1) == 0):
-                    Alien()
-                
-                alienreload = ALIEN_RELOAD
-
-        # Drop bombs
-        if last_palne and not int(random.random()* BOMB_ODDS):
-            Bomb(last_palne.sprite)
-        if lastalien and not int(random.random() * BOMB_ODDS):
-            Bomb(lastalien.sprite)
-
-        # Detect collisions between aliens and players.
-        for plane in pg.sprite.spritecollide(player,planes,1):
-            if pg.mixer:
-                boom_sound.play()
-            Explosion(plane)
-            Explosion(player)
-            SCORE = SCORE + 1
-            player.kill()
-        
-        for alien in pg.sprite.spritecollide(player, aliens, 1):
-            if pg.mixer:
-                boom_sound.play()
-            Explosion(alien)
-            Explosion(player)
-            SCORE = SCORE + 1
-            player.kill()
-
-        # Detect collisions between balloon and player.
-        for balloon in pg.sprite.spritecollide(player, balloons, 1):
-            if pg.mixer:
-                punch_sound.play()
-            Explosion(balloon)
-            Explosion(player)
-            SCORE = SCORE + 1
-            player.kill()
-
-
-        # See if shots hit the aliens.
-        for plane in pg.sprite.groupcollide(planes, shots, 1,1).keys():
-            if pg.mixer:
-                boom_sound.play()
-            Explosion(plane)
-            SCORE = SCORE + 1
-        for alien in pg.sprite.groupcollide(aliens, shots, 1, 1).keys():
-            if pg.mixer:
-                boom_sound.play()
-            Explosion(alien)
-            SCORE = SCORE + 1
-
-        #Shots hitting balloon
-        for balloon in pg.sprite.groupcollide(balloons, shots, 1, 1).keys():
-            if pg.mixer:
-                punch_sound.play()
-            Explosion(balloon)
-            SCORE = SCORE + 1
-
-        # See if alien boms hit the player.
-        for bomb in pg.sprite.spritecollide(player, bombs, 1):
-            if pg.mixer:
-                boom_sound.play()
-            Explosion(player)
-            Explosion(bomb)
-            player.kill()
-
-        # draw the scene
-        dirty = all.draw(screen)
-        pg.display.update(dirty)
+    def tick():
+        """plays one game tick, False once the game is over
 
-        # cap the framerate at 40fps. Also called 40HZ or 40 times per second.
-        clock.tick(40)
+        Games in a window end when the player dies. Headless ones respawn
+        the player and end after 'frames' ticks.
+        """
+        if headless:
+            if game.state.tick >= frames:
+                return False
+            if not game.player.alive():
+                game.respawn()
+        elif not game.player.alive():
+            return False
+        if not uncapped:
+            interpolator.snapshot(all)
+
+        if controls:
+            keystate = controls.get_pressed()
+        else:
+            keystate = pg.key.get_pressed()
+        if log:
+            log.add(keystate)
+
+        scroller.update()
+        game.step(keystate)
+        return True
+
+    def draw(alpha):
+        """draws the scene 'alpha' of the way from the last tick to this one"""
+        nonlocal renders
+        # clear/erase the last drawn sprites, or draw the scrolling
+        # background, which repaints the whole screen anyway
+        if scroller.speed:
+            scroller.draw(screen, alpha)
+        else:
+            all.clear(screen, background)
+        timer.lap("clear")
+
+        # draw the scene, part way between the last two ticks
+        dirty = interpolator.draw(all, screen, alpha)
+        timer.lap("draw")
+        # the scrolling background changes every pixel of every frame
+        regions.present(dirty, full=bool(scroller.speed))
+        renders = renders + 1
+        timer.lap("display")
+
+    def present(alpha):
+        """draws one frame for the AsyncRunner, which times the waits"""
+        draw(alpha)
+        timer.end_frame()
+        timer.start()
+        effects.end_frame()
+
+    async def play(runner):
+        """runs the game on 'runner', along with its telemetry and recording"""
+        server = client = None
+        if telemetry:
+            address = telemetry
+            if telemetry is True:
+                server = StandInServer()
+                await server.start()
+                address = "127.0.0.1", server.port
+            client = Telemetry(*address)
+            client.start()
+            state = game.state
+            game.events.subscribe(Hit, lambda hits: client.send(
+                event="hit", tick=state.tick, hits=len(hits), score=state.score))
+            game.events.subscribe(PlayerDeath, lambda deaths: client.send(
+                event="death", tick=state.tick, score=state.score))
+
+        await runner.run()
+        saving = None
+        if log:
+            log.end(game)
+            saving = asyncio.get_running_loop().run_in_executor(None, log.save, record)
+        if client:
+            client.send(event="score", seed=seed, score=game.state.score,
+                        deaths=game.state.deaths)
+            await client.close()
+        if saving:
+            await saving
+        if server:
+            await server.close()
+        return client, server
 
+    # Run our main loop whilst the player is alive.
+    # The game is simulated in fixed ticks of 1/TICK_RATE seconds on an
+    # AsyncRunner, and drawn on a timer of its own part way between the
+    # last two ticks, while the telemetry and saving run in between.
+    # Uncapped headless runs do one tick and one frame at a time instead.
+    runner = client = server = None
+    if uncapped:
+        while True:
+            timer.start()
+            if not poll() or not tick():
+                break
+            draw(1.0)
+            # no frame cap, to see how fast the loop can go
+            clock.tick(0)
+            timer.lap("wait")
+            timer.end_frame()
+            effects.end_frame()
+        if log:
+            log.end(game)
+            log.save(record)
+    else:
+        runner = AsyncRunner(lambda: poll() and tick(), present, timer.lap)
+        client, server = asyncio.run(play(runner))
+
+    if trace:
+        timer.close_trace()
+
+    if headless:
+        seconds = time.perf_counter() - started
+        stats = game.stats()
+        stats.update({
+            "renders": renders,
+            "seconds": seconds,
+            "fps": game.state.tick / seconds if seconds else 0.0,
+            "phases": timer.totals,
+            "percentiles": timer.percentiles(),
+            "assets": assets.stats(),
+            "display": regions.stats(),
+            "sounds": effects.stats(),
+        })
+        if runner:
+            stats.update({
+                "late": runner.stats(),
+                "telemetry": client and client.stats(),
+                "received": server and server.received,
+            })
+        return stats
+
+    if quitting:
+        return
     if pg.mixer:
         pg.mixer.music.fadeout(1000)
     pg.time.wait(1000)
@@ -704,5 +3138,141 @@ def main(winstyle=0):
 
 # call the "main" function if running this script
 if __name__ == "__main__":
-    main()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Pygame Aliens")
+    parser.add_argument("--headless", action="store_true",
+                        help="run uncapped under the dummy drivers and print timings")
+    parser.add_argument("--frames", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--enemy", choices=tuple(ENEMIES) + ("none",),
+                        default="alien")
+    parser.add_argument("--json", action="store_true",
+                        help="print the headless statistics as JSON")
+    parser.add_argument("--record", metavar="FILE",
+                        help="save the game's seed and keys to FILE")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="replay a recorded game headless and check its ending")
+    parser.add_argument("--sweep", action="append", metavar="NAME=V1,V2,...",
+                        help="play headless games for every combination of "
+                        "these values, NAME one of %s; speeds are percentages"
+                        % ", ".join(sorted(SWEEP_PARAMS)))
+    parser.add_argument("--games", type=int, default=20,
+                        help="games per combination in a sweep")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="processes a sweep runs on, one per core by default")
+    parser.add_argument("--out", default="sweep.csv",
+                        help="CSV file a sweep writes")
+    parser.add_argument("--bot", action="store_true",
+                        help="headless games are played by a bot instead of at random")
+    parser.add_argument("--profile", action="store_true",
+                        help="show the time each phase of a frame takes, F3 toggles it")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="save every frame's phases to FILE as Chrome trace JSON")
+    parser.add_argument("--build-atlas", action="store_true",
+                        help="pack the sprite and button images into data/atlas.png")
+    parser.add_argument("--build-bundle", action="store_true",
+                        help="decode the images and sounds into data/assets.bundle")
+    parser.add_argument("--no-bundle", action="store_true",
+                        help="load the image and sound files, not the bundle")
+    parser.add_argument("--bench-collide", action="store_true",
+                        help="compare grid and brute force collision cost")
+    parser.add_argument("--max-shots", type=int, default=MAX_SHOTS)
+    parser.add_argument("--alien-odds", type=int, default=ALIEN_ODDS)
+    parser.add_argument("--bomb-odds", type=int, default=BOMB_ODDS)
+    parser.add_argument("--alien-reload", type=int, default=ALIEN_RELOAD)
+    parser.add_argument("--enemy-speed", type=int, default=ENEMY_SPEED,
+                        help="percent of every enemy kind's own speed")
+    parser.add_argument("--bomb-speed", type=int, default=BOMB_SPEED,
+                        help="percent of the bombs' own speed")
+    parser.add_argument("--rect-collide", action="store_true",
+                        help="skip the pixel perfect mask test")
+    parser.add_argument("--pool-size", type=int, default=POOL_SIZE,
+                        help="most killed sprites kept for reuse, per class")
+    parser.add_argument("--scroll-speed", type=int, default=SCROLL_SPEED,
+                        help="background scroll speed, 0 keeps it still")
+    parser.add_argument("--tick-rate", type=int, default=TICK_RATE,
+                        help="game ticks per second")
+    parser.add_argument("--frame-rate", type=int, default=FRAME_RATE,
+                        help="most frames drawn per second, 0 for no limit")
+    parser.add_argument("--numpy-movers", action="store_true",
+                        help="move enemies and bombs with numpy arrays")
+    parser.add_argument("--bench-movers", action="store_true",
+                        help="compare per sprite and numpy enemy movement")
+    parser.add_argument("--sessions", type=int, default=0, metavar="N",
+                        help="step N headless games side by side in one process")
+    parser.add_argument("--async", dest="run_async", action="store_true",
+                        help="play headless in real time on asyncio, sending telemetry")
+    parser.add_argument("--telemetry", metavar="HOST:PORT",
+                        help="send telemetry here while playing; --async sends it "
+                        "to a local stand-in if not set")
+    parser.add_argument("--check-async", action="store_true",
+                        help="check --async's telemetry and timing against a local stand-in")
+    args = parser.parse_args()
+    if args.seed is not None and not 0 <= args.seed < 1 << 32:
+        # recordings keep the seed as an unsigned 32 bit number
+        parser.error("--seed must be from 0 to %d" % ((1 << 32) - 1))
+    for name in ("max_shots", "alien_odds", "bomb_odds", "alien_reload",
+                 "enemy_speed", "bomb_speed"):
+        # and the game constants as signed 16 bit numbers
+        if not 0 <= getattr(args, name) < 1 << 15:
+            parser.error("--%s must be from 0 to %d" % (name.replace("_", "-"), (1 << 15) - 1))
+    MAX_SHOTS = args.max_shots
+    ALIEN_ODDS = args.alien_odds
+    BOMB_ODDS = args.bomb_odds
+    ALIEN_RELOAD = args.alien_reload
+    ENEMY_SPEED = args.enemy_speed
+    BOMB_SPEED = args.bomb_speed
+    PIXEL_PERFECT = not args.rect_collide
+    POOL_SIZE = args.pool_size
+    NUMPY_MOVERS = args.numpy_movers
+    SCROLL_SPEED = args.scroll_speed
+    TICK_RATE = args.tick_rate
+    FRAME_RATE = args.frame_rate
+    BUNDLE = not args.no_bundle
+    enemy = None if args.enemy == "none" else args.enemy
+    address = None
+    if args.telemetry:
+        host, _, port = args.telemetry.rpartition(":")
+        address = host, int(port)
+    if args.replay:
+        if not replay(args.replay):
+            raise SystemExit(1)
+    elif args.sweep:
+        grid = {}
+        for option in args.sweep:
+            name, _, values = option.partition("=")
+            if name not in SWEEP_PARAMS:
+                parser.error("can't sweep %s" % name)
+            grid[name] = [int(value) for value in values.split(",")]
+        sweep(grid, games=args.games, frames=args.frames, enemy=enemy,
+              bot=args.bot, path=args.out, jobs=args.jobs, seed=args.seed or 0)
+    elif args.build_atlas:
+        build_atlas()
+    elif args.build_bundle:
+        build_bundle()
+    elif args.bench_collide:
+        bench_collisions()
+    elif args.bench_movers:
+        bench_movers()
+    elif args.check_async:
+        if not check_async(seed=args.seed or 0):
+            raise SystemExit(1)
+    elif args.run_async:
+        play_async(frames=args.frames, seed=args.seed, enemy=enemy, bot=args.bot,
+                   telemetry=address, record=args.record)
+    elif args.sessions:
+        simulate(games=args.sessions, frames=args.frames, enemy=enemy, bot=args.bot,
+                 seed=args.seed or 0)
+    elif args.headless:
+        stats = main(headless=True, frames=args.frames, seed=args.seed,
+                     enemy=enemy, record=args.record, bot=args.bot,
+                     trace=args.trace)
+        if args.json:
+            print(json.dumps(stats))
+        else:
+            print_stats(stats)
+    else:
+        main(seed=args.seed, record=args.record, profile=args.profile,
+             trace=args.trace, telemetry=address)
     pg.quit()